@@ -0,0 +1,34 @@
+"""
+Time of hashing pandas DataFrames through the generic pickler versus through the
+numpy buffers of their columns.
+
+"""
+from utils import measure, report, setup_django
+
+setup_django()
+
+import numpy as np  # noqa
+import pandas as pd  # noqa
+from estimators import hashing  # noqa
+
+
+def frames():
+    rng = np.random.RandomState(0)
+    yield 'wide numeric, 1000 x 5000', pd.DataFrame(rng.rand(1000, 5000))
+    yield 'long numeric, 10M x 4', pd.DataFrame(rng.rand(10 ** 7, 4), columns=list('abcd'))
+    yield 'strings, 1M x 2', pd.DataFrame({
+        'city': rng.choice(['paris', 'london', 'new york'], 10 ** 6),
+        'user': ['user_%d' % i for i in range(10 ** 6)],
+    })
+    mixed = pd.DataFrame(rng.rand(10 ** 6, 8))
+    mixed['label'] = rng.choice(['a', 'b', 'c'], 10 ** 6)
+    mixed['when'] = pd.date_range('2016-01-01', periods=10 ** 6, freq='s')
+    yield 'mixed, 1M x 10', mixed
+
+
+if __name__ == '__main__':
+    for name, frame in frames():
+        print(name)
+        for pandas in [False, True]:
+            _, duration, peak = measure(hashing.hash, frame, pandas=pandas)
+            report('  %s' % ('column buffers' if pandas else 'pickler'), duration, peak)
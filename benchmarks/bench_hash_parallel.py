@@ -0,0 +1,21 @@
+"""
+Time of hashing a large numpy array in one pass versus as a parallel tree of blocks.
+
+"""
+import os
+
+from utils import measure, report, setup_django
+
+setup_django()
+
+import numpy as np  # noqa
+from estimators import hashing  # noqa
+
+
+if __name__ == '__main__':
+    arr = np.random.RandomState(0).rand(2 ** 27)  # 1 GB
+    print('%.1f GB array, %d cores' % (arr.nbytes / 2 ** 30, os.cpu_count()))
+    for hash_name in ['md5', 'sha256', 'blake2b']:
+        for parallel in [False, True]:
+            _, duration, _ = measure(hashing.hash, arr, hash_name=hash_name, parallel=parallel)
+            report('%s%s' % (hash_name, '+tree' if parallel else ''), duration)
@@ -0,0 +1,53 @@
+"""
+Peak memory of loading large estimators and datasets, when the whole file is
+read before deserializing versus when it is deserialized from the file handle.
+
+"""
+import io
+
+from utils import measure, report, setup_django
+
+setup_django()
+
+import numpy as np  # noqa
+from estimators import serializers  # noqa
+from estimators.models import DataSet, Estimator  # noqa
+
+
+def load_read_whole(instance):
+    """the former load(): read the whole file, then deserialize the bytes"""
+    instance.object_file.open()
+    data = instance.object_file.read()
+    instance.object_file.close()
+    serializer = serializers.get_serializer(instance.object_format)
+    return serializer.load(io.BytesIO(data))
+
+
+def load_streaming(instance):
+    instance.load()
+    return instance.object_property
+
+
+def run(label, model, obj):
+    instance = model()
+    instance.set_object(obj)
+    instance.save()
+    del obj
+
+    size = instance.object_file.size
+    print('%s, %.1f MB on disk (%s)' % (label, size / 2 ** 20, instance.object_format))
+    for name, loader in [('read whole file', load_read_whole), ('streaming load', load_streaming)]:
+        fresh = model.objects.get(pk=instance.pk)
+        _, duration, peak = measure(loader, fresh)
+        report('  ' + name, duration, peak)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    estimator = {
+        'coefficients': [rng.rand(1000) for _ in range(2000)],
+        'vocabulary': dict(('token_%d' % i, i) for i in range(200000)),
+    }
+    run('Estimator', Estimator, estimator)
+    run('DataSet', DataSet, rng.rand(4000, 2000))
+    run('DataSet of python objects', DataSet, [list(range(100)) for _ in range(20000)])
@@ -0,0 +1,42 @@
+"""
+Helpers shared by the benchmark scripts.  Run a benchmark from the repository root:
+
+    python benchmarks/bench_load_memory.py
+
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def setup_django():
+    """configure django with the test settings, an in-memory database and a temporary MEDIA_ROOT"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'estimators.tests.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    settings.MEDIA_ROOT = tempfile.mkdtemp()
+    call_command('migrate', verbosity=0)
+
+
+def measure(func, *args, **kwargs):
+    """return the result of func, its duration in seconds and its peak of allocated memory in bytes"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def report(name, duration, peak=None):
+    if peak is None:
+        print('%-40s %8.3f s' % (name, duration))
+    else:
+        print('%-40s %8.3f s %10.1f MB' % (name, duration, peak / 2 ** 20))
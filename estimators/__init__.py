@@ -1,9 +1,67 @@
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
 import os
 
 ESTIMATOR_DIR = getattr(settings, "ESTIMATOR_DIR", 'estimators/')
 DATASET_DIR = getattr(settings, "DATASET_DIR", 'datasets/')
+# size limit in bytes of the in-process cache of loaded objects, 0 disables it
+CACHE_MAX_BYTES = getattr(settings, "ESTIMATORS_CACHE_MAX_BYTES", 0)
+# object hashes of the estimators and datasets loaded and kept in memory by `preload()`, so
+# that pre-fork servers, like gunicorn with preload_app, share them between their workers
+PRELOAD = getattr(settings, "ESTIMATORS_PRELOAD", ())
+# preload them when the app is ready, in every process setting django up, management commands
+# included, rather than by calling `estimators.preload.preload()` in the master of the server
+PRELOAD_ON_READY = getattr(settings, "ESTIMATORS_PRELOAD_ON_READY", False)
+# mmap_mode used to open arrays stored as .npy files, None loads them into memory
+MMAP_MODE = getattr(settings, "ESTIMATORS_MMAP_MODE", 'r')
+# size in bytes of the chunks used when streaming objects to and from storage
+CHUNK_SIZE = getattr(settings, "ESTIMATORS_CHUNK_SIZE", 2 ** 20)
+# size in bytes of the read buffer used when loading objects
+READ_BUFFER_SIZE = getattr(settings, "ESTIMATORS_READ_BUFFER_SIZE", 2 ** 16)
+# serializer used to persist objects, unless one is configured for their type
+DEFAULT_SERIALIZER = getattr(settings, "ESTIMATORS_SERIALIZER", 'dill')
+# serializer per object type, as {'<module>.<class name>': '<serializer name>'}
+SERIALIZERS = getattr(settings, "ESTIMATORS_SERIALIZERS", {'numpy.ndarray': 'npy'})
+# hash algorithm of new objects, any algorithm of hashlib, like 'md5', 'sha256' or 'blake2b',
+# followed by '+tree' to hash numpy arrays as a tree of blocks, in parallel, and/or by
+# '+pandas' to hash pandas objects through the numpy buffers of their columns, or by
+# '+content' to hash the persisted file, serializing objects only once
+HASH_SCHEME = getattr(settings, "ESTIMATORS_HASH_SCHEME", 'md5')
+# hash schemes under which objects are looked up by `filter` and `get_or_create`.
+# rows hashed under other schemes have to be re-keyed with the `rehash_objects` command
+LOOKUP_HASH_SCHEMES = getattr(settings, "ESTIMATORS_LOOKUP_HASH_SCHEMES", (HASH_SCHEME, 'md5'))
+# directory of the lock files serializing the loads and writes of a same object between the
+# processes of a host, like the workers of a web server, None to only coordinate the threads
+# of a process
+LOAD_LOCK_DIR = getattr(settings, "ESTIMATORS_LOAD_LOCK_DIR", None)
+# number of threads hashing and writing objects in bulk operations, None for one per core
+MAX_WORKERS = getattr(settings, "ESTIMATORS_MAX_WORKERS", None)
+# number of threads running the blocking calls of the async API, like `aload` and `asave`
+ASYNC_WORKERS = getattr(settings, "ESTIMATORS_ASYNC_WORKERS", 4)
+# reuse the predictions of an earlier evaluation of the same estimator on the same X_test,
+# rather than predicting again, unless `evaluate` is called with force=True
+CACHE_EVALUATIONS = getattr(settings, "ESTIMATORS_CACHE_EVALUATIONS", False)
+# number and width in characters of the hash prefixes used as nested directories, like
+# datasets/ab/cd/<hash> for a depth of 2 and a width of 2.  0 stores files flat
+SHARD_DEPTH = getattr(settings, "ESTIMATORS_SHARD_DEPTH", 0)
+SHARD_WIDTH = getattr(settings, "ESTIMATORS_SHARD_WIDTH", 2)
+# dotted path of the storage class of the object files, like 'estimators.storage.PackStorage',
+# None for django's default_storage
+STORAGE = getattr(settings, "ESTIMATORS_STORAGE", None)
+# PackStorage: directory of the pack files, by default the 'packs' directory of MEDIA_ROOT,
+# size in bytes up to which objects are packed and size in bytes of a pack file
+PACK_DIR = getattr(settings, "ESTIMATORS_PACK_DIR", None)
+PACK_THRESHOLD = getattr(settings, "ESTIMATORS_PACK_THRESHOLD", 2 ** 16)
+PACK_MAX_BYTES = getattr(settings, "ESTIMATORS_PACK_MAX_BYTES", 2 ** 30)
+# CachedStorage: directory of the local disk cache, by default in the temporary directory,
+# its size limit in bytes, and the dotted path of the storage class it caches, None for
+# django's default_storage
+DISK_CACHE_DIR = getattr(settings, "ESTIMATORS_DISK_CACHE_DIR", None)
+DISK_CACHE_MAX_BYTES = getattr(settings, "ESTIMATORS_DISK_CACHE_MAX_BYTES", 10 * 2 ** 30)
+DISK_CACHE_STORAGE = getattr(settings, "ESTIMATORS_DISK_CACHE_STORAGE", None)
+
+default_app_config = 'estimators.apps.EstimatorConfig'
 
 files_map = {
     '_estimator': ESTIMATOR_DIR,
@@ -11,12 +69,19 @@ files_map = {
 }
 
 
-def get_upload_path(instance, filename):
+def get_upload_path(instance, filename, depth=None, width=None):
+    ''' return the path of a file named after a hash, sharded by the prefixes of the hash,
+    by default as configured by SHARD_DEPTH and SHARD_WIDTH '''
     directory = files_map[instance._object_property_name]
-    relative_path = os.path.join(directory, filename)
+    depth = SHARD_DEPTH if depth is None else depth
+    width = SHARD_WIDTH if width is None else width
+    shards = [filename[i * width:(i + 1) * width] for i in range(depth)]
+    relative_path = os.path.join(directory, *(shards + [filename]))
     return relative_path
 
 
 def get_storage():
     ''' return configured Storage '''
+    if STORAGE is not None:
+        return import_string(STORAGE)()
     return default_storage  # for default filesystem, (location=settings.MEDIA_ROOT)
@@ -2,6 +2,29 @@ from django.contrib import admin
 
 from estimators.models import DataSet, Estimator, EvaluationResult
 
-admin.site.register(Estimator)
-admin.site.register(DataSet)
-admin.site.register(EvaluationResult)
+# the changelists only display metadata columns, so that listing rows never loads their objects
+OBJECT_COLUMNS = ('object_type', 'object_shape', 'object_dtype', 'object_size', 'object_format')
+
+
+@admin.register(Estimator)
+class EstimatorAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'description', 'object_hash') + OBJECT_COLUMNS + ('create_date',)
+    search_fields = ('description', 'object_hash')
+    readonly_fields = ('object_hash', 'hash_scheme', 'object_file') + OBJECT_COLUMNS
+
+
+@admin.register(DataSet)
+class DataSetAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'description', 'object_hash') + OBJECT_COLUMNS + ('object_columns', 'create_date')
+    search_fields = ('description', 'object_hash', 'object_columns')
+    readonly_fields = ('object_hash', 'hash_scheme', 'object_file') + OBJECT_COLUMNS + ('object_columns',)
+
+
+@admin.register(EvaluationResult)
+class EvaluationResultAdmin(admin.ModelAdmin):
+
+    list_display = ('id', '_estimator_proxy', '_X_test_proxy', '_y_test_proxy', '_y_predicted_proxy', 'create_date')
+    list_select_related = ('_estimator_proxy', '_X_test_proxy', '_y_test_proxy', '_y_predicted_proxy')
+    raw_id_fields = ('_estimator_proxy', '_X_test_proxy', '_y_test_proxy', '_y_predicted_proxy')
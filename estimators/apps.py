@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class EstimatorConfig(AppConfig):
     name = 'estimators'
+
+    def ready(self):
+        from estimators import PRELOAD, PRELOAD_ON_READY
+        if PRELOAD_ON_READY and PRELOAD:
+            from estimators.preload import preload_if_migrated
+            preload_if_migrated()
@@ -0,0 +1,168 @@
+"""
+An in-process cache of loaded objects, keyed by their content hash, and the
+coordination of concurrent loads and writes of a same hash.
+
+"""
+import threading
+from collections import OrderedDict
+
+from estimators import CACHE_MAX_BYTES
+
+_MISSING = object()
+
+
+class ObjectCache(object):
+
+    """A thread-safe LRU cache of deserialized objects, bounded in bytes.
+
+    Entries are keyed by ``object_hash``.  Since objects are content
+    addressed, an entry can never go stale; it is only evicted once the
+    total size of the cache grows over ``max_bytes``.  The size of an entry
+    is the size of its serialized payload.  A ``max_bytes`` of 0 disables
+    the cache.
+
+    Cached objects are shared between every model instance that loads the
+    same hash, so they must be treated as read-only.
+
+    Pinned objects, like the ones preloaded before a server forks its
+    workers, are served even when the cache is disabled, and never evicted.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._pinned
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key, default=None):
+        """return the object cached under key and mark it as recently used"""
+        obj = self._pinned.get(key, _MISSING)
+        if obj is not _MISSING:
+            self.hits += 1
+            return obj
+        if not self.enabled:
+            return default
+        with self._lock:
+            try:
+                obj, size = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return obj
+
+    def set(self, key, obj, size):
+        """cache obj under key, evicting the least recently used objects
+        until the cache fits in max_bytes.  Returns whether obj was cached."""
+        if not self.enabled or size > self.max_bytes:
+            return False
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (obj, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return True
+
+    def pin(self, key, obj):
+        """cache obj under key until it is unpinned, regardless of max_bytes"""
+        with self._lock:
+            self._pinned[key] = obj
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.pop(key, None)
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'pinned': len(self._pinned),
+            'current_bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """Coalesces concurrent calls under a same key.
+
+    The first thread calling ``do`` with a key runs the function, the threads
+    calling it with the same key meanwhile wait and get its result, or its
+    exception.  Once the call is done, the next one runs the function again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+object_cache = ObjectCache(max_bytes=CACHE_MAX_BYTES)
+object_loads = SingleFlight()
+object_writes = SingleFlight()
@@ -0,0 +1,89 @@
+"""
+Thread pools shared by the bulk operations on hashable objects and by the
+async API.
+
+Hashing and file writes mostly release the GIL, in hash objects, numpy and
+storage I/O, so they overlap well on threads.
+"""
+import asyncio
+import collections
+import functools
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from estimators import ASYNC_WORKERS, MAX_WORKERS
+
+_executor = None
+_async_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """return the thread pool of the bulk operations, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS or os.cpu_count() or 1)
+    return _executor
+
+
+def map_concurrently(func, *iterables):
+    """return the list of func applied to the items of iterables on the thread pool,
+    in order.  The first exception raised by func is raised again."""
+    return list(get_executor().map(func, *iterables))
+
+
+def map_bounded(executor, func, iterable, window):
+    """yield func applied to the items of iterable on executor, in order, with at most
+    window items submitted and not yet consumed, so that a lazy iterable is only
+    materialized window items at a time"""
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_pool(max_workers=None):
+    """return a process pool whose workers are forked, so that they inherit the django
+    setup of this process.  Spawned workers, the default on macOS and from Python 3.14 on
+    Linux, would import the models before django is set up.  Platforms without fork,
+    and Python versions before 3.7, use the default start method."""
+    if sys.version_info >= (3, 7) and 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'))
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def get_async_executor():
+    """return the thread pool of the async API, created on first use.  It is bounded by
+    ASYNC_WORKERS, which also bounds the database connections it opens."""
+    global _async_executor
+    with _executor_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS)
+    return _async_executor
+
+
+def _call_with_connections(func, *args, **kwargs):
+    # the threads of the pool outlive requests, let their connections expire like
+    # those of request threads
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_async(func, *args, **kwargs):
+    """return an asyncio future of func(*args, **kwargs), run on the thread pool of the
+    async API so that it does not block the event loop"""
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(
+        get_async_executor(), functools.partial(_call_with_connections, func, *args, **kwargs))
@@ -14,11 +14,15 @@ hashing of numpy arrays.
 
 import hashlib
 import io
+import os
 import pickle
 import struct
 # Compatibility layer for Python 3/Python 2 single codebase
 import sys
+import tempfile
+import threading
 import types
+from concurrent.futures import ThreadPoolExecutor
 
 PY3_OR_LATER = sys.version_info[0] >= 3
 PY26 = sys.version_info[:2] == (2, 6)
@@ -42,6 +46,77 @@ if PY3_OR_LATER:
 else:
     Pickler = pickle.Pickler
 
+# Size of the chunks in which a spilled pickle stream is fed to the hash
+_CHUNK_SIZE = 2 ** 20
+
+# Size of the blocks of an array buffer hashed separately in tree mode.
+# It is part of the tree digest: changing it changes every tree hash.
+TREE_BLOCK_SIZE = 2 ** 22
+
+_tree_executor = None
+_tree_executor_lock = threading.Lock()
+
+
+def _get_tree_executor():
+    """ Return the thread pool hashing the blocks of array buffers. Hash
+        objects release the GIL while hashing large buffers.
+    """
+    global _tree_executor
+    with _tree_executor_lock:
+        if _tree_executor is None:
+            _tree_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _tree_executor
+
+
+def _block_digest(hash_name, block):
+    return hashlib.new(hash_name, block).digest()
+
+
+def tree_digest(buffer, hash_name='md5'):
+    """ Return the root digest of the blocks of a flat byte buffer: the
+        blocks of TREE_BLOCK_SIZE bytes are hashed in parallel and their
+        digests are hashed in order.
+    """
+    buffer = memoryview(buffer)
+    blocks = [buffer[start:start + TREE_BLOCK_SIZE]
+              for start in range(0, len(buffer), TREE_BLOCK_SIZE)]
+    if len(blocks) > 1:
+        digests = _get_tree_executor().map(
+            lambda block: _block_digest(hash_name, block), blocks)
+    else:
+        digests = [_block_digest(hash_name, block) for block in blocks]
+    root = hashlib.new(hash_name)
+    for digest in digests:
+        root.update(digest)
+    return root.digest()
+
+
+# Modes of a hash scheme, and the keyword argument of `hash` they enable.
+# The 'content' mode hashes the serialized file instead, see `HashingWriter`.
+SCHEME_MODES = {
+    'tree': 'parallel',
+    'pandas': 'pandas',
+    'content': 'content',
+}
+
+
+def parse_scheme(hash_scheme):
+    """ Return the options of a hash scheme: a hash name, optionally
+        followed by modes joined with '+', like 'blake2b+pandas+tree'.
+        Except for 'content', the options are keyword arguments of `hash`.
+    """
+    hash_name = hash_scheme.split('+')[0]
+    options = dict((option, False) for option in SCHEME_MODES.values())
+    for mode in hash_scheme.split('+')[1:]:
+        if mode not in SCHEME_MODES:
+            raise ValueError('Unknown mode %r of hash scheme %r' % (mode, hash_scheme))
+        options[SCHEME_MODES[mode]] = True
+    if options['content'] and (options['parallel'] or options['pandas']):
+        raise ValueError('The content mode of hash scheme %r cannot be combined '
+                         'with other modes' % hash_scheme)
+    options['hash_name'] = hash_name
+    return options
+
 
 class _ConsistentSet(object):
 
@@ -71,21 +146,64 @@ class _MyHash(object):
         self.args = args
 
 
+class _HashWriter(object):
+
+    """ File-like object that feeds everything written to it to a hash
+        object, without buffering it.
+    """
+
+    def __init__(self, hash_obj):
+        self.write = hash_obj.update
+
+
+class HashingWriter(object):
+
+    """ File-like object that writes through to a file object while
+        hashing everything written, so that an object serialized once
+        yields both its file and its digest.
+    """
+
+    def __init__(self, fileobj, hash_name='md5'):
+        self.fileobj = fileobj
+        self._hash = hashlib.new(hash_name)
+
+    def write(self, data):
+        self._hash.update(data)
+        return self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
 class Hasher(Pickler):
 
     """ A subclass of pickler, to do cryptographic hashing, rather than
         pickling.
     """
 
-    def __init__(self, hash_name='md5'):
-        self.stream = io.BytesIO()
+    def __init__(self, hash_name='md5', stream=False):
+        """
+            Parameters
+            ----------
+            hash_name: string
+                The hash algorithm to be used
+            stream: boolean
+                Feed the pickled stream to the hash as it is written,
+                instead of buffering it whole. The digest is the same.
+        """
+        # Initialise the hash obj
+        self._hash = hashlib.new(hash_name)
+        self.stream = self._make_stream(stream)
         # By default we want a pickle protocol that only changes with
         # the major python version and not the minor one
         protocol = (pickle.DEFAULT_PROTOCOL if PY3_OR_LATER
                     else pickle.HIGHEST_PROTOCOL)
         Pickler.__init__(self, self.stream, protocol=protocol)
-        # Initialise the hash obj
-        self._hash = hashlib.new(hash_name)
+
+    def _make_stream(self, stream):
+        if stream:
+            return _HashWriter(self._hash)
+        return io.BytesIO()
 
     def hash(self, obj, return_digest=True):
         try:
@@ -93,8 +211,15 @@ class Hasher(Pickler):
         except pickle.PicklingError as e:
             e.args += ('PicklingError while hashing %r: %r' % (obj, e),)
             raise
-        dumps = self.stream.getvalue()
-        self._hash.update(dumps)
+        if isinstance(self.stream, io.BytesIO):
+            dumps = self.stream.getvalue()
+            self._hash.update(dumps)
+        elif not isinstance(self.stream, _HashWriter):
+            # the stream was spilled to a temporary file
+            self.stream.seek(0)
+            for chunk in iter(lambda: self.stream.read(_CHUNK_SIZE), b''):
+                self._hash.update(chunk)
+            self.stream.close()
         if return_digest:
             return self._hash.hexdigest()
 
@@ -186,7 +311,8 @@ class NumpyHasher(Hasher):
     """ Special case the hasher for when numpy is loaded.
     """
 
-    def __init__(self, hash_name='md5', coerce_mmap=False):
+    def __init__(self, hash_name='md5', coerce_mmap=False, stream=False,
+                 parallel=False, pandas=False):
         """
             Parameters
             ----------
@@ -195,17 +321,37 @@ class NumpyHasher(Hasher):
             coerce_mmap: boolean
                 Make no difference between np.memmap and np.ndarray
                 objects.
+            stream: boolean
+                Do not buffer the pickled stream whole in memory.
+            parallel: boolean
+                Hash array buffers as a tree of blocks, on a thread pool.
+                This gives different digests.
+            pandas: boolean
+                Hash the numpy buffers of pandas objects, rather than
+                pickling them. This gives different digests.
         """
         self.coerce_mmap = coerce_mmap
-        Hasher.__init__(self, hash_name=hash_name)
+        self.parallel = parallel
+        self.hash_name = hash_name
+        Hasher.__init__(self, hash_name=hash_name, stream=stream)
         # delayed import of numpy, to avoid tight coupling
         import numpy as np
         self.np = np
+        # pandas objects can only be met if pandas is already imported
+        self.pd = sys.modules.get('pandas') if pandas else None
         if hasattr(np, 'getbuffer'):
             self._getbuffer = np.getbuffer
         else:
             self._getbuffer = memoryview
 
+    def _make_stream(self, stream):
+        # The content of arrays is fed to the hash as they are met, ahead of
+        # the pickled stream. To keep the same digest, the pickled stream is
+        # spilled to a temporary file past _CHUNK_SIZE rather than streamed.
+        if stream:
+            return tempfile.SpooledTemporaryFile(max_size=_CHUNK_SIZE)
+        return io.BytesIO()
+
     def save(self, obj):
         """ Subclass the save method, to hash ndarray subclass, rather
             than pickling them. Off course, this is a total abuse of
@@ -232,8 +378,13 @@ class NumpyHasher(Hasher):
             # https://github.com/numpy/numpy/issues/4983. The
             # workaround is to view the array as bytes before
             # taking the memoryview.
-            self._hash.update(
-                self._getbuffer(obj_c_contiguous.view(self.np.uint8)))
+            if self.parallel:
+                self._hash.update(tree_digest(
+                    obj_c_contiguous.view(self.np.uint8).reshape(-1),
+                    self.hash_name))
+            else:
+                self._hash.update(
+                    self._getbuffer(obj_c_contiguous.view(self.np.uint8)))
 
             # We store the class, to be able to distinguish between
             # Objects with the same binary content, but different
@@ -264,10 +415,82 @@ class NumpyHasher(Hasher):
             # the array dtype according to the numpy doc.
             klass = obj.__class__
             obj = (klass, ('HASHED', obj.descr))
+        elif self.pd is not None and isinstance(
+                obj, (self.pd.DataFrame, self.pd.Series, self.pd.Index)):
+            obj = self._reduce_pandas(obj)
         Hasher.save(self, obj)
 
+    def _reduce_pandas(self, obj):
+        """ Reduce a pandas object to its columns and index, rather than
+            pickling its block manager. The numpy buffers of the columns are
+            fed to the hash directly.
+        """
+        klass = obj.__class__
+        if isinstance(obj, self.pd.DataFrame):
+            dtypes = set(obj.dtypes)
+            dtype = dtypes.pop() if len(dtypes) == 1 else None
+            if isinstance(dtype, self.np.dtype) and not dtype.hasobject:
+                # A frame of a single numpy dtype is hashed as a whole, one
+                # column after the other. Its values are a view of its block.
+                columns = obj.to_numpy().T
+                self._hash_c_order(columns)
+                return (klass, ('HASHED', str(dtype), columns.shape,
+                                obj.columns, obj.index))
+            columns = [self._hash_pandas_values(column)
+                       for _, column in obj.items()]
+            return (klass, ('HASHED', columns, obj.columns, obj.index))
+        elif isinstance(obj, self.pd.Series):
+            return (klass, ('HASHED', self._hash_pandas_values(obj), obj.name,
+                            obj.index))
+        elif isinstance(obj, self.pd.RangeIndex):
+            return (klass, ('HASHED', obj.start, obj.stop, obj.step,
+                            obj.name))
+        elif isinstance(obj, self.pd.MultiIndex):
+            return (klass, ('HASHED', list(obj.levels),
+                            [self.np.asarray(codes) for codes in obj.codes],
+                            list(obj.names)))
+        return (klass, ('HASHED', self._hash_pandas_values(obj), obj.name))
+
+    def _hash_pandas_values(self, obj):
+        """ Feed the values of a Series or an Index to the hash, and return
+            what remains to be pickled to describe them. Strings are reduced
+            to the 64 bit hashes of their values, computed in a vectorized
+            way. Other object values are left to the pickler.
+        """
+        values = obj.to_numpy()
+        kind = 'values'
+        if values.dtype.hasobject:
+            inferred = self.pd.api.types.infer_dtype(values, skipna=False)
+            if inferred not in ('string', 'bytes'):
+                return (str(obj.dtype), values)
+            # hash_array hashes 'a' and b'a' alike, the inferred kind tells them apart
+            values, kind = self.pd.util.hash_array(values), inferred
+        self._hash_c_order(values)
+        return (str(obj.dtype), kind, values.dtype.str, len(values))
+
+    def _hash_c_order(self, values):
+        """ Feed the bytes of an array in C order to the hash. Strided
+            arrays, like the columns of a 2d block, are hashed one chunk of
+            rows at a time, rather than copied whole.
+        """
+        if self.parallel:
+            values = self.np.ascontiguousarray(values)
+            self._hash.update(tree_digest(
+                values.view(self.np.uint8).reshape(-1), self.hash_name))
+        elif values.flags.c_contiguous:
+            self._hash.update(self._getbuffer(values.view(self.np.uint8)))
+        elif values.ndim > 1 and values[:1].nbytes > _CHUNK_SIZE:
+            for row in values:
+                self._hash_c_order(row)
+        else:
+            step = max(1, _CHUNK_SIZE // max(1, values[:1].nbytes))
+            for start in range(0, len(values), step):
+                chunk = self.np.ascontiguousarray(values[start:start + step])
+                self._hash.update(self._getbuffer(chunk.view(self.np.uint8)))
+
 
-def hash(obj, hash_name='md5', coerce_mmap=False):
+def hash(obj, hash_name='md5', coerce_mmap=False, stream=False,
+         parallel=False, pandas=False):
     """ Quick calculation of a hash to identify uniquely Python objects
         containing numpy arrays.
         Parameters
@@ -277,9 +500,19 @@ def hash(obj, hash_name='md5', coerce_mmap=False):
             faster.
         coerce_mmap: boolean
             Make no difference between np.memmap and np.ndarray
+        stream: boolean
+            Hash the pickled stream as it is written instead of buffering
+            it whole in memory. The digest is the same.
+        parallel: boolean
+            Hash numpy buffers as a tree of blocks on a thread pool, which
+            scales with the number of cores. The digest is different.
+        pandas: boolean
+            Hash pandas objects through the numpy buffers of their columns
+            and index. The digest is different.
     """
     if 'numpy' in sys.modules:
-        hasher = NumpyHasher(hash_name=hash_name, coerce_mmap=coerce_mmap)
+        hasher = NumpyHasher(hash_name=hash_name, coerce_mmap=coerce_mmap,
+                             stream=stream, parallel=parallel, pandas=pandas)
     else:
-        hasher = Hasher(hash_name=hash_name)
+        hasher = Hasher(hash_name=hash_name, stream=stream)
     return hasher.hash(obj)
@@ -0,0 +1,38 @@
+"""
+File locks shared by the threads and processes of a host.
+
+Locks are taken with ``fcntl.flock`` where it is available.  Elsewhere they
+only hold between the threads of a process.
+"""
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _get_thread_lock(path):
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """hold a lock on the file at path, created if needed.  The lock is exclusive unless
+    shared, in which case it only excludes exclusive holders."""
+    if fcntl is None:
+        with _get_thread_lock(path):
+            yield
+        return
+    # flock locks belong to the open file, so threads opening the file exclude each other
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from estimators.models import DataSet, Estimator
+from estimators.storage import PackStorage
+
+
+class Command(BaseCommand):
+
+    help = 'Rewrite the pack files of the PackStorage without the objects no row refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=float, default=3600,
+            help='age in seconds under which unreferenced objects are kept, as their rows may '
+                 'not be inserted yet')
+
+    def handle(self, *args, **options):
+        storages = set(model._meta.get_field('object_file').storage for model in (Estimator, DataSet))
+        storages = [storage for storage in storages if isinstance(storage, PackStorage)]
+        if not storages:
+            raise CommandError('The object files are not stored by a PackStorage, see ESTIMATORS_STORAGE')
+        live_names = set(
+            instance.upload_path for model in (Estimator, DataSet)
+            for instance in model.objects.only('object_file', 'object_hash').iterator())
+        for storage in storages:
+            removed = storage.compact(live_names, min_age=options['min_age'])
+            self.stdout.write('Removed %d objects from the packs of %s' % (removed, storage.pack_location))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from estimators.preload import memory_usage
+
+
+class Command(BaseCommand):
+
+    help = 'Report the shared and private memory of processes, like the workers of a pre-fork server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids', nargs='+', help='ids of the processes')
+
+    def handle(self, *args, **options):
+        row = '%10s %12s %12s %12s %12s'
+        self.stdout.write(row % ('pid', 'rss MB', 'pss MB', 'shared MB', 'private MB'))
+        for pid in options['pids']:
+            usage = memory_usage(pid)
+            self.stdout.write(row % ((pid,) + tuple(
+                '%.1f' % (usage[field] / 2 ** 20) for field in ('rss', 'pss', 'shared', 'private'))))
@@ -0,0 +1,71 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from estimators import HASH_SCHEME, get_upload_path
+from estimators.models import DataSet, Estimator
+from estimators.models.base import describe_object
+from estimators.storage import save_object_file
+
+
+class Command(BaseCommand):
+
+    help = 'Re-key the estimators and datasets hashed under another hash scheme than the configured one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hash-scheme', default=HASH_SCHEME,
+            help='hash scheme to re-key the objects to, by default ESTIMATORS_HASH_SCHEME')
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='number of rows re-keyed per transaction')
+
+    def handle(self, *args, **options):
+        for model in (Estimator, DataSet):
+            rekeyed = self.rehash_model(model, options['hash_scheme'], options['batch_size'])
+            self.stdout.write('Re-keyed %d %s objects to %s' % (
+                rekeyed, model.__name__, options['hash_scheme']))
+
+    def rehash_model(self, model, hash_scheme, batch_size):
+        queryset = model.objects.exclude(hash_scheme=hash_scheme).order_by('pk')
+        rekeyed, last_pk = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return rekeyed
+            last_pk = batch[-1].pk
+            rekeyed += self.rehash_batch(model, batch, hash_scheme)
+
+    def rehash_batch(self, model, batch, hash_scheme):
+        """copy the file of each row to its new hash and update the rows in a single
+        transaction, then delete the former files"""
+        storage = model._meta.get_field('object_file').storage
+        stale_files = []
+        with transaction.atomic():
+            for instance in batch:
+                obj = instance.get_object()
+                object_hash, serialized = model._hash_object(obj, hash_scheme)
+                if model.objects.filter(object_hash=object_hash).exists():
+                    self.stderr.write('Skipped %s %s, its content is already stored as %s' % (
+                        model.__name__, instance.pk, object_hash))
+                    continue
+                object_format = instance.object_format
+                if serialized is None:
+                    f = storage.open(instance.object_file.name)
+                else:
+                    # content schemes hash the file as serialized now, write that one
+                    serializer, f = serialized
+                    object_format = serializer.name
+                    f.seek(0)
+                with f:
+                    content = File(f)
+                    object_size = content.size
+                    file_name = save_object_file(storage, get_upload_path(instance, object_hash), content)
+                # the metadata describe the new file, which content schemes serialize again
+                model.objects.filter(pk=instance.pk).update(
+                    object_hash=object_hash, hash_scheme=hash_scheme, object_file=file_name,
+                    object_format=object_format, object_size=object_size, **describe_object(obj))
+                stale_files.append(instance.object_file.name)
+        for file_name in stale_files:
+            storage.delete(file_name)
+        return len(stale_files)
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from estimators import SHARD_DEPTH, SHARD_WIDTH, get_upload_path
+from estimators.executors import map_concurrently
+from estimators.models import DataSet, Estimator
+from estimators.storage import save_object_file
+
+
+class Command(BaseCommand):
+
+    help = ('Move the files of the estimators and datasets to the sharded layout, while they stay '
+            'readable: each file is copied, its row updated, then the former file deleted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depth', type=int, default=SHARD_DEPTH,
+            help='number of nested directories, by default ESTIMATORS_SHARD_DEPTH')
+        parser.add_argument(
+            '--width', type=int, default=SHARD_WIDTH,
+            help='number of hash characters per directory, by default ESTIMATORS_SHARD_WIDTH')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='number of rows moved per transaction')
+
+    def handle(self, *args, **options):
+        for model in (Estimator, DataSet):
+            moved = self.shard_model(model, options['depth'], options['width'], options['batch_size'])
+            self.stdout.write('Moved %d %s files' % (moved, model.__name__))
+
+    def shard_model(self, model, depth, width, batch_size):
+        queryset = model.objects.order_by('pk')
+        moved, last_pk = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return moved
+            last_pk = batch[-1].pk
+            moves = [(instance, get_upload_path(instance, instance.object_hash, depth, width))
+                     for instance in batch]
+            moves = [(instance, target) for instance, target in moves if instance.upload_path != target]
+            moved += self.move_batch(model, moves)
+
+    def move_batch(self, model, moves):
+        """copy the files concurrently, update the rows in a single transaction, then
+        delete the former files"""
+        storage = model._meta.get_field('object_file').storage
+        sources = map_concurrently(lambda move: self.copy_file(storage, *move), moves)
+        with transaction.atomic():
+            for (instance, target), source in zip(moves, sources):
+                if source is not None:
+                    model.objects.filter(pk=instance.pk).update(object_file=target)
+        map_concurrently(storage.delete, [
+            source for (_, target), source in zip(moves, sources) if source not in (None, target)])
+        return sum(source is not None for source in sources)
+
+    def copy_file(self, storage, instance, target):
+        """copy the file of instance to target, unless it is there already, and return
+        its former path, or None if it is missing"""
+        source = instance.upload_path
+        if not storage.exists(source):
+            # rows stored with a bare hash before paths were recorded, in the flat layout
+            source = get_upload_path(instance, instance.object_hash, depth=0)
+            if not storage.exists(source):
+                self.stderr.write('Skipped %s %s, its file is missing' % (type(instance).__name__, instance.pk))
+                return None
+        if not storage.exists(target):
+            with storage.open(source) as f:
+                save_object_file(storage, target, f)
+        return source
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 02:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimators', '0002_object_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='hash_scheme',
+            field=models.CharField(default='md5', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='estimator',
+            name='hash_scheme',
+            field=models.CharField(default='md5', editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='dataset',
+            name='object_hash',
+            field=models.CharField(default=None, editable=False, max_length=128, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='estimator',
+            name='object_hash',
+            field=models.CharField(default=None, editable=False, max_length=128, unique=True),
+        ),
+    ]
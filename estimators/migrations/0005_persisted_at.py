@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 02:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_persisted(apps, schema_editor):
+    # rows have always been saved after their file was persisted
+    for model_name in ('Estimator', 'DataSet'):
+        apps.get_model('estimators', model_name).objects.update(persisted_at=F('create_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimators', '0004_object_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='persisted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='estimator',
+            name='persisted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_persisted, migrations.RunPython.noop),
+    ]
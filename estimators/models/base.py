@@ -1,10 +1,70 @@
+import asyncio
+import io
+import itertools
+import operator
 import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import reduce
 
-import dill
-from django.core.files.base import ContentFile
-from django.db import models
+from django.core.files.base import File
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
-from estimators import get_storage, get_upload_path, hashing
+from estimators import (CHUNK_SIZE, HASH_SCHEME, LOAD_LOCK_DIR, LOOKUP_HASH_SCHEMES, READ_BUFFER_SIZE,
+                        get_storage, get_upload_path, hashing, serializers)
+from estimators.cache import object_cache, object_loads, object_writes
+from estimators.executors import map_concurrently, run_async
+from estimators.locks import file_lock
+from estimators.storage import save_object_file
+
+_MISSING = object()
+
+
+def describe_object(obj):
+    """return the metadata columns of obj: its type and, for arrays and frames, its shape,
+    dtype and columns"""
+    klass = type(obj)
+    metadata = {'object_type': ('%s.%s' % (klass.__module__, klass.__qualname__))[:255]}
+    shape = getattr(obj, 'shape', None)
+    if isinstance(shape, tuple):
+        metadata['object_shape'] = str(shape)[:255]
+    dtype = getattr(obj, 'dtype', None)
+    dtypes = getattr(obj, 'dtypes', None)
+    if dtype is not None:
+        metadata['object_dtype'] = str(dtype)[:255]
+    elif dtypes is not None and hasattr(dtypes, '__iter__'):
+        metadata['object_dtype'] = ','.join(sorted(set(str(d) for d in dtypes)))[:255]
+    columns = getattr(obj, 'columns', None)
+    if columns is not None and hasattr(columns, '__iter__'):
+        metadata['object_columns'] = ','.join(str(column) for column in columns)
+    return metadata
+
+
+class _HashMemo(threading.local):
+
+    """hashes computed during a lookup flow, keyed by object identity and hash scheme"""
+
+    entries = None
+
+
+_hash_memo = _HashMemo()
+
+
+@contextmanager
+def hash_memo():
+    """hash each object at most once within this block, however many lookups and
+    instances it goes through.  Objects must not be mutated within the block."""
+    if _hash_memo.entries is not None:
+        yield
+        return
+    _hash_memo.entries = {}
+    try:
+        yield
+    finally:
+        _hash_memo.entries = None
 
 
 class PrimaryMixin(models.Model):
@@ -21,10 +81,14 @@ class HashableFileQuerySet(models.QuerySet):
     object_property_name = NotImplementedError()
 
     def filter(self, *args, **kwargs):
-        """filter lets django managers use `objects.filter` on a hashable object."""
+        """filter lets django managers use `objects.filter` on a hashable object.
+
+        The object is looked up under every hash scheme of LOOKUP_HASH_SCHEMES, so that
+        tables holding rows hashed under different schemes still resolve.
+        """
         obj = kwargs.pop(self.object_property_name, None)
         if obj is not None:
-            kwargs['object_hash'] = self.model._compute_hash(obj)
+            args += (self.model._hash_lookup(obj),)
         return super().filter(*args, **kwargs)
 
     def _extract_model_params(self, defaults, **kwargs):
@@ -32,26 +96,168 @@ class HashableFileQuerySet(models.QuerySet):
         `objects.update_or_create` on a hashable object.
         """
         obj = kwargs.pop(self.object_property_name, None)
-        if obj is not None:
-            kwargs['object_hash'] = self.model._compute_hash(obj)
         lookup, params = super()._extract_model_params(defaults, **kwargs)
         if obj is not None:
+            # the object is hashed by `filter` for the lookup, and by the model for the params
+            lookup[self.object_property_name] = obj
             params[self.object_property_name] = obj
-            del params['object_hash']
         return lookup, params
 
+    def get_or_create(self, defaults=None, **kwargs):
+        with hash_memo():
+            return super().get_or_create(defaults=defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, **kwargs):
+        with hash_memo():
+            return super().update_or_create(defaults=defaults, **kwargs)
+
+    def aget_or_create(self, defaults=None, **kwargs):
+        """return an asyncio future of `get_or_create`, run off the event loop"""
+        return run_async(self.get_or_create, defaults=defaults, **kwargs)
+
+    def aupdate_or_create(self, defaults=None, **kwargs):
+        """return an asyncio future of `update_or_create`, run off the event loop"""
+        return run_async(self.update_or_create, defaults=defaults, **kwargs)
+
+    def bulk_get_or_create(self, objs):
+        """look up or create the rows of many hashable objects at once.
+
+        Objects are hashed concurrently and looked up with a single query.  The files of
+        the new rows are written concurrently and the rows inserted with `bulk_create` in
+        a single transaction.  Return a list of (instance, created) tuples, in the order
+        of objs.
+        """
+        hashed = map_concurrently(self._hash_instance, list(objs))
+        results, new_instances = self._resolve_hashed(hashed)
+        map_concurrently(self._persist_instance, new_instances)
+        self._bulk_create_hashed(new_instances)
+        return results
+
+    def missing_files(self, batch_size=1000):
+        """return the rows whose file is missing from the storage.  The storage is checked
+        concurrently, batch_size rows at a time."""
+        rows, missing = self.only('pk', 'object_hash', 'object_file').iterator(), []
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return missing
+            stored = map_concurrently(lambda row: row.object_file.storage.exists(row.upload_path), batch)
+            missing.extend(row for row, exists in zip(batch, stored) if not exists)
+
+    def _hash_instance(self, obj):
+        """return a new instance of obj and the hashes obj is looked up by"""
+        instance, lookup_hashes = self.model(), []
+        for scheme in OrderedDict.fromkeys((HASH_SCHEME,) + tuple(LOOKUP_HASH_SCHEMES)):
+            object_hash, serialized = self.model._hash_object(obj, scheme)
+            if scheme == HASH_SCHEME:
+                instance._set_hashed_object(obj, object_hash, serialized)
+            if scheme in LOOKUP_HASH_SCHEMES:
+                lookup_hashes.append(object_hash)
+        return instance, lookup_hashes
+
+    def _hash_unsaved(self, instance):
+        """return an unsaved instance and the hashes it is looked up by, like
+        `_hash_instance`, reusing the hash its object was assigned under HASH_SCHEME"""
+        obj, lookup_hashes = instance.get_object(), []
+        for scheme in OrderedDict.fromkeys(LOOKUP_HASH_SCHEMES):
+            if scheme == instance.hash_scheme:
+                lookup_hashes.append(instance._compute_object_hash())
+            else:
+                lookup_hashes.append(self.model._hash_object(obj, scheme)[0])
+        return instance, lookup_hashes
+
+    def _get_hashed_rows(self, hashed):
+        """return the existing rows of the hashed instances by object_hash, with their
+        object set"""
+        hashes = set(h for _, lookup_hashes in hashed for h in lookup_hashes)
+        rows = dict((row.object_hash, row) for row in self.filter(object_hash__in=hashes))
+        for instance, lookup_hashes in hashed:
+            for object_hash in lookup_hashes:
+                row = rows.get(object_hash)
+                if row is not None and row.object_property is None:
+                    # the object hashes to the row, there is no need to load it
+                    row.object_property = instance.object_property
+                    row._object_hash_memo = (row.object_property, row.hash_scheme, row.object_hash)
+        return rows
+
+    def _resolve_hashed(self, hashed):
+        """return the (instance, created) tuples of the hashed instances, with their
+        existing rows looked up in a single query, and the list of the new instances"""
+        rows = self._get_hashed_rows(hashed)
+        results, new_instances = [], OrderedDict()
+        for instance, lookup_hashes in hashed:
+            row = next((rows[h] for h in lookup_hashes if h in rows), None)
+            if row is not None:
+                results.append((row, False))
+            elif instance.object_hash in new_instances:
+                # an object given more than once is created once
+                results.append((new_instances[instance.object_hash], False))
+            else:
+                new_instances[instance.object_hash] = instance
+                results.append((instance, True))
+        return results, list(new_instances.values())
+
+    @staticmethod
+    def _persist_instance(instance):
+        instance._persist_file()
+
+    def _bulk_create_hashed(self, instances):
+        """insert instances in a single transaction and set their primary keys.  Rows
+        inserted concurrently in the meantime are skipped, and their pk used instead."""
+        if not instances:
+            return
+        for attempt in range(2):
+            hashes = [instance.object_hash for instance in instances]
+            try:
+                with transaction.atomic(using=self.db):
+                    existing = set(self.filter(object_hash__in=hashes).values_list('object_hash', flat=True))
+                    self.bulk_create([i for i in instances if i.object_hash not in existing])
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+        pks = dict(self.filter(object_hash__in=hashes).values_list('object_hash', 'pk'))
+        for instance in instances:
+            instance.pk = pks[instance.object_hash]
+            instance._state.adding = False
+            instance._state.db = self.db
+
 
 class HashableFileMixin(models.Model):
 
     create_date = models.DateTimeField(
         auto_now_add=True, blank=False, null=False)
     object_hash = models.CharField(
-        max_length=64, unique=True, default=None, null=False, editable=False)
+        max_length=128, unique=True, default=None, null=False, editable=False)
+    # name of the hash algorithm of object_hash
+    hash_scheme = models.CharField(
+        max_length=32, default='md5', null=False, editable=False)
     object_file = models.FileField(
         upload_to=get_upload_path, storage=get_storage(), default=None, null=False, blank=True, editable=False)
+    # name of the serializer backend of object_file, blank for files persisted with dill
+    # before formats were recorded
+    object_format = models.CharField(
+        max_length=32, default='', null=False, blank=True, editable=False)
+    # metadata of the object, recorded when it is persisted, so that listing rows never
+    # loads their objects.  Blank for rows persisted before they were recorded
+    object_size = models.BigIntegerField(null=True, blank=True, editable=False)
+    object_type = models.CharField(
+        max_length=255, default='', null=False, blank=True, editable=False)
+    object_shape = models.CharField(
+        max_length=255, default='', null=False, blank=True, editable=False)
+    object_dtype = models.CharField(
+        max_length=255, default='', null=False, blank=True, editable=False)
+    object_columns = models.TextField(default='', null=False, blank=True, editable=False)
+    # when the file was persisted, or found stored.  Saving rows with a persisted_at does not
+    # check the storage; `objects.missing_files()` does
+    persisted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     _object_property_name = NotImplementedError()
     _persisted = False
+    # (object, hash_scheme, object_hash) of the last object assigned or loaded
+    _object_hash_memo = (None, None, None)
+    # (object, serializer, file) of an object serialized by its content hash scheme
+    _serialized = (None, None, None)
 
     objects = HashableFileQuerySet.as_manager()
 
@@ -60,8 +266,12 @@ class HashableFileMixin(models.Model):
 
     @property
     def upload_path(self):
+        """the path of the file in its storage: the stored one, so that files stay found
+        when the layout changes until they are moved, or the path of the hash"""
         if self.object_file.name is not None:
             dir_name, file_name = os.path.split(self.object_file.name)
+            if dir_name:
+                return self.object_file.name
             return get_upload_path(self, file_name)
 
     @property
@@ -71,11 +281,66 @@ class HashableFileMixin(models.Model):
 
     @property
     def is_file_persisted(self):
-        return self.object_file.name is not None and self.object_file.storage.exists(self.file_path)
+        return self.object_file.name is not None and self.object_file.storage.exists(self.upload_path)
+
+    @classmethod
+    def _compute_hash(cls, obj, hash_scheme=None):
+        """return the hash of obj under hash_scheme, by default the configured HASH_SCHEME"""
+        return cls._hash_object(obj, hash_scheme)[0]
 
     @classmethod
-    def _compute_hash(cls, obj):
-        return hashing.hash(obj)
+    def _hash_object(cls, obj, hash_scheme=None):
+        """return the hash of obj under hash_scheme and, for content schemes, the
+        (serializer, file) obj was serialized to in order to hash it, or None"""
+        hash_scheme = hash_scheme or HASH_SCHEME
+        entries = _hash_memo.entries
+        if entries is not None and (id(obj), hash_scheme) in entries:
+            return entries[id(obj), hash_scheme][1:]
+        options = hashing.parse_scheme(hash_scheme)
+        if options.pop('content'):
+            serialized, object_hash = cls._serialize(obj, options['hash_name'])
+        else:
+            # memory-mapped arrays hash like the arrays they were loaded from
+            serialized, object_hash = None, hashing.hash(obj, coerce_mmap=True, stream=True, **options)
+        if entries is not None:
+            # keep a reference to obj, so that its id is not reused within the flow
+            entries[id(obj), hash_scheme] = (obj, object_hash, serialized)
+        return object_hash, serialized
+
+    @classmethod
+    def _serialize(cls, obj, hash_name=None):
+        """serialize obj into a temporary file that spills to disk past CHUNK_SIZE, so
+        the whole payload is never held in memory.  Return the serializer and the file,
+        and the hash of its content if hash_name is given."""
+        serializer = serializers.choose_serializer(obj)
+        fileobj = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+        if hash_name is None:
+            serializer.dump(obj, fileobj)
+            return (serializer, fileobj), None
+        writer = hashing.HashingWriter(fileobj, hash_name)
+        serializer.dump(obj, writer)
+        return (serializer, fileobj), writer.hexdigest()
+
+    def _compute_object_hash(self):
+        """return the hash of the object property under the hash scheme of the row.  It is
+        computed once per object assigned; reassign an object after mutating it."""
+        if self.object_property is None and self.persisted_at is not None:
+            # a stored row is trusted to match its hash, there is no need to load its object
+            return self.object_hash
+        obj = self.get_object()
+        memo_obj, hash_scheme, object_hash = self._object_hash_memo
+        if memo_obj is not obj or hash_scheme != self.hash_scheme:
+            object_hash = self._compute_hash(obj, self.hash_scheme)
+            self._object_hash_memo = (obj, self.hash_scheme, object_hash)
+        return object_hash
+
+    @classmethod
+    def _hash_lookup(cls, obj):
+        """return the Q object matching obj under any of the LOOKUP_HASH_SCHEMES"""
+        schemes = OrderedDict.fromkeys(LOOKUP_HASH_SCHEMES)
+        return reduce(operator.or_, [
+            models.Q(hash_scheme=scheme, object_hash=cls._compute_hash(obj, scheme))
+            for scheme in schemes])
 
     @property
     def object_property(self):
@@ -90,35 +355,166 @@ class HashableFileMixin(models.Model):
             self.load()
         return self.object_property
 
+    def aget_object(self):
+        """return an asyncio future of the object, loaded off the event loop if needed"""
+        if self.object_property is not None:
+            future = asyncio.Future()
+            future.set_result(self.object_property)
+            return future
+        return run_async(self.get_object)
+
     def set_object(self, value):
-        object_hash = self._compute_hash(value)
+        self._set_hashed_object(value, *self._hash_object(value))
+
+    def _set_hashed_object(self, value, object_hash, serialized=None):
+        """set value, hashed under HASH_SCHEME to object_hash"""
         self.object_property = value
         self.object_hash = object_hash
+        self.hash_scheme = HASH_SCHEME
         self.object_file.name = self.object_hash
+        self._object_hash_memo = (value, self.hash_scheme, object_hash)
+        # the file of the new object is not known to be stored yet
+        self.persisted_at = None
+        if serialized is not None:
+            # persist the file that was hashed rather than serializing value again
+            self._serialized = (value,) + serialized
 
     def persist(self):
         """a private method that persists an estimator object to the filesystem"""
         if self.object_hash:
-            data = dill.dumps(self.object_property)
-            f = ContentFile(data)
-            self.object_file.save(self.object_hash, f, save=False)
+            obj = self.object_property
+            serialized_obj, serializer, fileobj = self._serialized
+            self._serialized = (None, None, None)
+            if fileobj is not None and serialized_obj is obj and not fileobj.closed:
+                fileobj.seek(0)
+            else:
+                (serializer, fileobj), _ = self._serialize(obj)
+            f = File(fileobj)
+            f.DEFAULT_CHUNK_SIZE = CHUNK_SIZE
+            self.object_format = serializer.name
+            self.object_size = f.size
+            self._record_metadata(obj)
+            # threads persisting the same object meanwhile share a single write
+            name = self.upload_path
+            self.object_file.name = object_writes.do(name, self._write_file, name, f)
+            self.object_file._committed = True
             f.close()
+            self.persisted_at = timezone.now()
             self._persisted = True
         return self._persisted
 
+    def _write_file(self, name, f):
+        """write f under name unless the file is stored already, see `save_object_file`"""
+        storage = self.object_file.storage
+        if LOAD_LOCK_DIR is None:
+            return save_object_file(storage, name, f)
+        with file_lock(os.path.join(LOAD_LOCK_DIR, '%s.lock' % self.object_hash)):
+            return save_object_file(storage, name, f)
+
     def load(self):
-        """a private method that loads an estimator object from the filesystem"""
-        if self.is_file_persisted:
-            self.object_file.open()
-            temp = dill.loads(self.object_file.read())
-            self.set_object(temp)
-            self.object_file.close()
+        """a private method that loads an estimator object from the filesystem.  Concurrent
+        loads of a same hash are coalesced, one thread reads the file and the others share
+        the object it loaded"""
+        if self.object_hash:
+            obj = object_cache.get(self.object_hash, _MISSING)
+            if obj is _MISSING:
+                obj = object_loads.do(self.object_hash, self._read_object)
+        else:
+            obj = self._read_object()
+        if obj is _MISSING:
+            return
+        if self.object_hash:
+            # the file is named after the hash of its content, no need to compute it again
+            self.object_property = obj
+            self._object_hash_memo = (obj, self.hash_scheme, self.object_hash)
+        else:
+            self.set_object(obj)
 
-    def save(self, *args, **kwargs):
+    def _read_object(self):
+        """return the object deserialized from its file, or _MISSING if it is not stored"""
+        # rows that were persisted are not checked against the storage before opening their file
+        if self.persisted_at is None and not self.is_file_persisted:
+            return _MISSING
+        if LOAD_LOCK_DIR is None or not self.object_hash:
+            return self._deserialize_file()
+        with file_lock(os.path.join(LOAD_LOCK_DIR, '%s.lock' % self.object_hash)):
+            return self._deserialize_file()
+
+    def _deserialize_file(self):
+        if self.object_hash and self.object_hash in object_cache:
+            # loaded by a thread whose load completed while this one waited
+            obj = object_cache.get(self.object_hash, _MISSING)
+            if obj is not _MISSING:
+                return obj
+        path, f = self._open_object_file()
+        with f:
+            if self.object_format:
+                serializer = serializers.get_serializer(self.object_format)
+            else:
+                serializer = serializers.detect_serializer(f)
+            # deserialize incrementally from the file, never reading it whole
+            obj = serializer.load(f, path=path)
+            # the recorded size spares a storage request, older rows fall back to what was read
+            size = self.object_size if self.object_size is not None else f.tell()
+        if self.object_hash and object_cache.enabled:
+            object_cache.set(self.object_hash, obj, size)
+        return obj
+
+    def aload(self):
+        """return an asyncio future of `load`, which reads and deserializes the file off
+        the event loop"""
+        return run_async(self.load)
+
+    def _open_object_file(self):
+        """return the local path of the object file, if the storage has one, and
+        the file opened for reading with a buffer of READ_BUFFER_SIZE bytes"""
+        storage = self.object_file.storage
+        try:
+            path = storage.path(self.upload_path)
+        except NotImplementedError:
+            return None, storage.open(self.upload_path, 'rb')
+        return path, io.open(path, 'rb', buffering=READ_BUFFER_SIZE)
+
+    def _record_metadata(self, obj):
+        for field_name, value in describe_object(obj).items():
+            setattr(self, field_name, value)
+
+    def _persist_file(self):
+        """persist the object unless its file is stored already.  The storage is only
+        checked for rows whose file was not seen stored yet."""
+        if self.persisted_at is not None:
+            return
         if not self.is_file_persisted:
             self.persist()
+            return
+        # record where the file is, in case the layout changes
+        self.object_file.name = self.upload_path
+        self.persisted_at = timezone.now()
+        if self.object_property is not None:
+            # a new row, or a row assigned another object
+            self.object_size = self.object_file.storage.size(self.upload_path)
+            self._record_metadata(self.object_property)
+
+    def describe(self):
+        """return a description of the object from the metadata columns, without loading it"""
+        details = [self.object_type or 'unknown type']
+        if self.object_shape:
+            details.append('shape %s' % self.object_shape)
+        if self.object_dtype:
+            details.append(self.object_dtype)
+        if self.object_size is not None:
+            details.append('%d bytes' % self.object_size)
+        return ', '.join(details)
+
+    def save(self, *args, **kwargs):
+        self._persist_file()
         super().save(*args, **kwargs)
 
+    def asave(self, *args, **kwargs):
+        """return an asyncio future of `save`, which hashes, serializes and writes the file,
+        and inserts the row off the event loop"""
+        return run_async(self.save, *args, **kwargs)
+
     @classmethod
     def get_or_create(cls, obj):
         """Deprecated in favor for the canonical `objects.get_or_create` method"""
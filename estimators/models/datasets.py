@@ -36,4 +36,7 @@ class DataSet(HashableFileMixin):
         super().save(*args, **kwargs)
 
     def __repr__(self):
-        return '<Dataset <Id %s - %s>>' % (self.id, str(self.data))
+        return '<Dataset <Id %s - %s>>' % (self.id, self.describe())
+
+    def __str__(self):
+        return 'DataSet %s: %s' % (self.id, self.describe())
@@ -48,7 +48,10 @@ class Estimator(HashableFileMixin):
 
     def __repr__(self):
         return '<Estimator <Id %s> <Hash %s>: %s>' % (
-            self.id, self.object_hash, self.estimator)
+            self.id, self.object_hash, self.describe())
+
+    def __str__(self):
+        return 'Estimator %s: %s' % (self.id, self.describe())
 
     @property
     def estimator(self):
@@ -64,7 +67,7 @@ class Estimator(HashableFileMixin):
         super().save(*args, **kwargs)
 
     def clean(self):
-        if self.object_hash != self._compute_hash(self.estimator):
+        if self.object_hash != self._compute_object_hash():
             raise ValidationError(
                 "object_hash '%s' should be set by the estimator '%s'" %
                 (self.object_hash, self.estimator))
@@ -1,11 +1,79 @@
 
 
-from django.db import models
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from estimators.models.base import PrimaryMixin
+from django.db import models, transaction
+
+from estimators import CACHE_EVALUATIONS
+from estimators.executors import map_bounded, map_concurrently, process_pool
+from estimators.models.base import HashableFileQuerySet, PrimaryMixin
 from estimators.models.datasets import DataSet
 from estimators.models.estimators import Estimator
 
+# progress of evaluate_many, reported as each cell of the grid completes
+CellReport = namedtuple('CellReport', [
+    'estimator', 'X_test', 'load_seconds', 'predict_seconds', 'completed', 'total'])
+
+# objects loaded by a worker process of evaluate_many, by model and object_hash
+_worker_objects = {}
+
+
+def _object_reference(instance):
+    """return what a worker process needs to load the object of instance from storage"""
+    return (type(instance), instance.object_hash, instance.hash_scheme,
+            instance.object_file.name, instance.object_format)
+
+
+def _load_reference(reference):
+    """return the object of a reference, loaded once per worker process"""
+    model, object_hash, hash_scheme, file_name, object_format = reference
+    if (model, object_hash) not in _worker_objects:
+        instance = model(object_hash=object_hash, hash_scheme=hash_scheme, object_format=object_format)
+        instance.object_file.name = file_name
+        instance.load()
+        _worker_objects[model, object_hash] = instance.object_property
+    return _worker_objects[model, object_hash]
+
+
+def _predict(estimator, X_test):
+    """return the prediction of estimator on X_test and its duration"""
+    start = time.perf_counter()
+    y_predicted = estimator.predict(X_test)
+    return y_predicted, time.perf_counter() - start
+
+
+def _predict_references(estimator_reference, X_test_reference):
+    """predict a cell of evaluate_many in a worker process.  Return the prediction,
+    the durations of loading the objects and of the prediction."""
+    start = time.perf_counter()
+    estimator = _load_reference(estimator_reference)
+    X_test = _load_reference(X_test_reference)
+    load_seconds = time.perf_counter() - start
+    return _predict(estimator, X_test) + (load_seconds,)
+
+
+def _n_rows(X):
+    return X.shape[0] if hasattr(X, 'shape') else len(X)
+
+
+def _row_chunks(X, batch_size):
+    """yield the consecutive chunks of batch_size rows of X, as views when X is a numpy
+    array or a memory-mapped one"""
+    rows = X.iloc if hasattr(X, 'iloc') else X
+    for start in range(0, _n_rows(X), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def _concatenate(chunks):
+    """concatenate the predictions of the chunks of rows"""
+    if hasattr(chunks[0], 'iloc'):
+        import pandas as pd
+        return pd.concat(chunks)
+    import numpy as np
+    return np.concatenate(chunks)
+
 
 class EvaluationMixin(object):
 
@@ -72,30 +140,179 @@ class Evaluator(EvaluationMixin):
         self.y_test = options.pop('y_test', None)
         self.y_predicted = options.pop('y_predicted', None)
 
-    def evaluate(self, persist=True):
-        result = self.estimator.predict(self.X_test)
+    def evaluate(self, persist=True, batch_size=None, n_jobs=None, backend='threads', force=False):
+        """predict X_test with the estimator and return the EvaluationResult.
+
+        With ESTIMATORS_CACHE_EVALUATIONS, the predictions of the latest evaluation of the
+        same estimator on the same X_test, by object_hash, are reused unless force is True.
+        That evaluation is returned itself if its y_test is the same too.
 
+        With a batch_size, X_test is predicted in chunks of batch_size rows that are
+        concatenated, so that a memory-mapped X_test is predicted out of core.  The chunks
+        are predicted on n_jobs workers, threads or processes according to backend, with
+        at most twice n_jobs chunks in flight.  Processes receive the estimator along with
+        every chunk.
+        """
+        cached = None if force or not CACHE_EVALUATIONS else self._cached_result()
+        if cached is not None and cached._y_test_proxy.object_hash == self._y_test_proxy.object_hash:
+            return cached
+        if cached is not None:
+            result = cached._y_predicted_proxy
+        else:
+            result = self._predict(batch_size, n_jobs, backend)
+
+        # the proxies of the evaluator are passed on, so that their objects are not hashed again
         options = {
             'y_predicted': result,
-            'X_test': self.X_test,
-            'y_test': self.y_test,
-            'estimator': self.estimator,
+            'X_test': self._X_test_proxy,
+            'y_test': self._y_test_proxy,
+            'estimator': self._estimator_proxy,
         }
         er = EvaluationResult(**options)
         if persist:
             self.persist_results(er)
         return er
 
+    def _cached_result(self):
+        """return the latest persisted EvaluationResult of the estimator on X_test, or None"""
+        return EvaluationResult.objects.filter(
+            _estimator_proxy__object_hash=self._estimator_proxy.object_hash,
+            _X_test_proxy__object_hash=self._X_test_proxy.object_hash,
+            _y_predicted_proxy__isnull=False,
+        ).select_related('_y_test_proxy', '_y_predicted_proxy').order_by('-pk').first()
+
+    def _predict(self, batch_size=None, n_jobs=None, backend='threads'):
+        # X_test without rows has no chunk, the estimator reports it as it would unbatched
+        if batch_size is None or not _n_rows(self.X_test):
+            return self.estimator.predict(self.X_test)
+        chunks = _row_chunks(self.X_test, batch_size)
+        if not n_jobs or n_jobs == 1:
+            return _concatenate([self.estimator.predict(chunk) for chunk in chunks])
+        executors = {'threads': ThreadPoolExecutor, 'processes': process_pool}
+        if backend not in executors:
+            raise ValueError('Unknown backend %r, choose from %s' % (backend, sorted(executors)))
+        with executors[backend](max_workers=n_jobs) as executor:
+            return _concatenate(list(map_bounded(executor, self.estimator.predict, chunks, 2 * n_jobs)))
+
     def persist_results(self, er):
-        er._estimator_proxy, _ = Estimator.objects.get_or_create(
-            estimator=er._estimator_proxy.estimator)
-        er._X_test_proxy, _ = DataSet.objects.get_or_create(
-            data=er._X_test_proxy.data)
-        er._y_test_proxy, _ = DataSet.objects.get_or_create(
-            data=er._y_test_proxy.data)
-        er._y_predicted_proxy, _ = DataSet.objects.get_or_create(
-            data=er._y_predicted_proxy.data)
-        er.save()
+        """get or create the estimator and the datasets of er, then save er.
+
+        The objects that are not persisted rows yet are hashed under the other lookup
+        schemes, if any, and their files written concurrently.  Their rows are looked up
+        with one query per table, and inserted along with er in a single transaction.
+        """
+        proxies = [er._estimator_proxy, er._X_test_proxy, er._y_test_proxy, er._y_predicted_proxy]
+        # proxies that are persisted rows already are kept as they are
+        pending = [proxy for proxy in proxies if proxy.pk is None]
+        hashed = map_concurrently(
+            lambda proxy: type(proxy).objects.all()._hash_unsaved(proxy), pending)
+        rows, new_instances = {}, []
+        for model in (Estimator, DataSet):
+            queryset = model.objects.all()
+            model_hashed = [(proxy, h) for proxy, h in zip(pending, hashed) if isinstance(proxy, model)]
+            results, new = queryset._resolve_hashed([h for _, h in model_hashed])
+            rows.update((id(proxy), row) for (proxy, _), (row, _) in zip(model_hashed, results))
+            new_instances.append((queryset, new))
+        map_concurrently(HashableFileQuerySet._persist_instance, [i for _, new in new_instances for i in new])
+        with transaction.atomic():
+            for queryset, new in new_instances:
+                queryset._bulk_create_hashed(new)
+            # foreign keys are assigned once the new rows have their primary key
+            er._estimator_proxy, er._X_test_proxy, er._y_test_proxy, er._y_predicted_proxy = [
+                rows.get(id(proxy), proxy) for proxy in proxies]
+            er.save()
+
+    @classmethod
+    def evaluate_many(cls, estimators, datasets, persist=True, n_jobs=None, progress=None):
+        """evaluate every estimator on every (X_test, y_test) pair of datasets.
+
+        Estimators and datasets are Estimator and DataSet objects or data in themselves.
+        They are persisted first, in bulk, then `predict` runs on a pool of n_jobs forked
+        processes, by default one per core, that load each of them from storage once.
+        n_jobs=1 predicts in this process instead.  progress, if given, is called with a
+        CellReport as each cell of the grid completes.
+
+        Return the EvaluationResults, estimator major.  Unless persist is False, the
+        predictions and the results are persisted in bulk in a single transaction; the
+        primary keys of the results are only set on backends that return them.  With
+        persist=False, the estimators and datasets are still persisted for the worker
+        processes to load them, unless n_jobs=1.
+        """
+        get_rows = cls._get_rows if persist or n_jobs != 1 else cls._get_proxies
+        estimator_rows = get_rows(Estimator, estimators)
+        dataset_rows = get_rows(DataSet, [X for X, _ in datasets] + [y for _, y in datasets])
+        cells = [(estimator, X_test, y_test) for estimator in estimator_rows
+                 for X_test, y_test in zip(dataset_rows[:len(datasets)], dataset_rows[len(datasets):])]
+
+        predictions = [None] * len(cells)
+        completed = 0
+
+        def report(index, y_predicted, predict_seconds, load_seconds):
+            nonlocal completed
+            predictions[index] = y_predicted
+            completed += 1
+            if progress is not None:
+                estimator, X_test, _ = cells[index]
+                progress(CellReport(estimator, X_test, load_seconds, predict_seconds, completed, len(cells)))
+
+        if n_jobs == 1:
+            for index, (estimator, X_test, _) in enumerate(cells):
+                start = time.perf_counter()
+                estimator, X_test = estimator.get_object(), X_test.get_object()
+                load_seconds = time.perf_counter() - start
+                report(index, *_predict(estimator, X_test) + (load_seconds,))
+        else:
+            with process_pool(max_workers=n_jobs) as executor:
+                futures = dict(
+                    (executor.submit(_predict_references, _object_reference(estimator),
+                                     _object_reference(X_test)), index)
+                    for index, (estimator, X_test, _) in enumerate(cells))
+                for future in as_completed(futures):
+                    report(futures[future], *future.result())
+
+        # the predictions are hashed concurrently rather than by the y_predicted setter
+        datasets = DataSet.objects.all()
+        hashed = map_concurrently(datasets._hash_instance, predictions)
+        results = [
+            EvaluationResult(estimator=estimator, X_test=X_test, y_test=y_test)
+            for estimator, X_test, y_test in cells]
+        for er, (y_predicted, _) in zip(results, hashed):
+            er._y_predicted_proxy = y_predicted
+        if persist:
+            cls._persist_many(results, hashed)
+        return results
+
+    @staticmethod
+    def _get_rows(model, objs):
+        """return the persisted rows of objs, instances of model or objects in themselves"""
+        pending = [obj for obj in objs if not (isinstance(obj, model) and obj.pk)]
+        rows = iter(model.objects.bulk_get_or_create(
+            obj.get_object() if isinstance(obj, model) else obj for obj in pending))
+        return [obj if isinstance(obj, model) and obj.pk else next(rows)[0] for obj in objs]
+
+    @staticmethod
+    def _get_proxies(model, objs):
+        """return objs as unsaved instances of model, unless they are instances already"""
+        proxies = []
+        for obj in objs:
+            if not isinstance(obj, model):
+                proxy, obj = model(), obj
+                proxy.set_object(obj)
+                obj = proxy
+            proxies.append(obj)
+        return proxies
+
+    @staticmethod
+    def _persist_many(results, hashed):
+        """persist the hashed predictions of results, then results, in bulk"""
+        datasets = DataSet.objects.all()
+        predicted, new_datasets = datasets._resolve_hashed(hashed)
+        map_concurrently(HashableFileQuerySet._persist_instance, new_datasets)
+        with transaction.atomic():
+            datasets._bulk_create_hashed(new_datasets)
+            for er, (y_predicted, _) in zip(results, predicted):
+                er._y_predicted_proxy = y_predicted
+            EvaluationResult.objects.bulk_create(results)
 
     def __repr__(self):
         return '<Evaluator(X_test=%s estimator=%s)>' % (
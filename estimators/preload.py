@@ -0,0 +1,90 @@
+"""
+Preloading of objects before a server forks its workers.
+
+Objects loaded in the master process are shared by the forked workers, copy
+on write, as long as neither side writes to their memory pages.  Reference
+counts and the cyclic garbage collector do write to the headers of every
+object they visit, so the preloaded objects are frozen out of the reach of
+the collector where ``gc.freeze`` is available, from Python 3.7.
+
+``memory_usage`` reports the shared and private memory of a process, to
+check how much of the workers' memory is actually shared.
+"""
+import gc
+import logging
+
+from django.db import DatabaseError, connection, connections
+
+from estimators import PRELOAD
+from estimators.cache import object_cache
+from estimators.models import DataSet, Estimator
+
+logger = logging.getLogger(__name__)
+
+# fields of /proc/<pid>/smaps, in kB, summed by memory_usage
+SMAPS_FIELDS = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'private',
+    'Private_Dirty': 'private',
+}
+
+
+def preload(object_hashes=None):
+    """load the estimators and datasets of object_hashes, by default the ones of
+    ESTIMATORS_PRELOAD, and pin them in the object cache.  Returns the loaded instances.
+    Call it in the master process, like in the `when_ready` hook of gunicorn or after
+    `get_wsgi_application()` with preload_app."""
+    object_hashes = list(PRELOAD if object_hashes is None else object_hashes)
+    instances = []
+    for model in (Estimator, DataSet):
+        instances.extend(model.objects.filter(object_hash__in=object_hashes))
+    missing = set(object_hashes) - set(instance.object_hash for instance in instances)
+    if missing:
+        raise ValueError('No estimator or dataset with the hashes %s' % ', '.join(sorted(missing)))
+    for instance in instances:
+        object_cache.pin(instance.object_hash, instance.get_object())
+    # connections opened in the master must not be shared by the workers
+    connections.close_all()
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    return instances
+
+
+def preload_if_migrated():
+    """preload the objects of ESTIMATORS_PRELOAD, as `preload` does, when the app is ready.
+    Every management command sets the app up, so nothing is preloaded until the tables are
+    migrated, and failures are logged rather than raised."""
+    try:
+        tables = connection.introspection.table_names()
+        if not all(model._meta.db_table in tables for model in (Estimator, DataSet)):
+            logger.info('Skipped preloading the estimators, their tables are not migrated yet')
+            return
+        preload()
+    except (DatabaseError, ValueError) as e:
+        logger.warning('Could not preload the estimators: %s', e)
+    finally:
+        connections.close_all()
+
+
+def memory_usage(pid='self'):
+    """return the rss, pss, shared and private memory in bytes of the process pid, from
+    /proc/<pid>/smaps.  Memory shared copy on write with the master is counted as shared
+    until a worker writes to it."""
+    usage = dict.fromkeys(SMAPS_FIELDS.values(), 0)
+    # smaps_rollup sums the mappings in the kernel, from Linux 4.14
+    for file_name in ('smaps_rollup', 'smaps'):
+        try:
+            f = open('/proc/%s/%s' % (pid, file_name))
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                field, _, value = line.partition(':')
+                if field in SMAPS_FIELDS:
+                    usage[SMAPS_FIELDS[field]] += int(value.split()[0]) * 1024
+        return usage
+    raise OSError('No memory maps of the process %s, memory_usage needs the /proc of Linux' % pid)
@@ -0,0 +1,209 @@
+"""
+Serializer backends used to persist and load hashable objects.
+
+Every backend writes to and reads from a file object.  The name of the backend
+used to persist an object is stored in the ``object_format`` column, so that
+``load`` can dispatch on it.  Files persisted before that column existed are
+recognized by their leading bytes.
+
+"""
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+from collections import OrderedDict
+
+import dill
+
+from estimators import CHUNK_SIZE, DEFAULT_SERIALIZER, MMAP_MODE, SERIALIZERS
+
+NPY_MAGIC = b'\x93NUMPY'
+
+# pickle protocol 5 is only available as of python 3.8
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+_registry = OrderedDict()
+
+
+def is_plain_array(obj):
+    """return True if obj is a numpy array that can be stored in the raw .npy layout"""
+    if 'numpy' not in sys.modules:
+        return False
+    import numpy as np
+    return type(obj) in (np.ndarray, np.memmap) and not obj.dtype.hasobject
+
+
+class Serializer(object):
+
+    """Base class of the serializer backends.
+
+    Subclasses set a unique ``name`` and implement ``dump`` and ``load``.
+    """
+
+    name = None
+    # leading bytes of the files written by this backend, if recognizable
+    magic = None
+
+    def accepts(self, obj):
+        """return True if obj can be persisted by this backend"""
+        return True
+
+    def dump(self, obj, fileobj):
+        raise NotImplementedError()
+
+    def load(self, fileobj, path=None):
+        """load an object from fileobj.  path is the local path of the file,
+        if there is one, for backends that can use it."""
+        raise NotImplementedError()
+
+
+class DillSerializer(Serializer):
+
+    name = 'dill'
+
+    def dump(self, obj, fileobj):
+        dill.dump(obj, fileobj)
+
+    def load(self, fileobj, path=None):
+        return dill.load(fileobj)
+
+
+class PickleSerializer(Serializer):
+
+    name = 'pickle'
+
+    def dump(self, obj, fileobj):
+        pickle.dump(obj, fileobj, protocol=PICKLE_PROTOCOL)
+
+    def load(self, fileobj, path=None):
+        return pickle.load(fileobj)
+
+
+class NpySerializer(Serializer):
+
+    """Stores a single numpy array in the raw .npy layout.
+
+    Arrays are memory-mapped on load when the file has a local path.
+    """
+
+    name = 'npy'
+    magic = NPY_MAGIC
+
+    def __init__(self, mmap_mode=None):
+        self.mmap_mode = mmap_mode
+
+    def accepts(self, obj):
+        return is_plain_array(obj)
+
+    def dump(self, obj, fileobj):
+        import numpy as np
+        np.save(fileobj, obj, allow_pickle=False)
+
+    def load(self, fileobj, path=None):
+        import numpy as np
+        if path is not None and self.mmap_mode is not None:
+            return np.load(path, mmap_mode=self.mmap_mode, allow_pickle=False)
+        return np.load(fileobj, allow_pickle=False)
+
+
+class _ArrayPickler(pickle.Pickler):
+
+    """Pickler that replaces plain numpy arrays by references to self.arrays"""
+
+    def __init__(self, fileobj, arrays):
+        pickle.Pickler.__init__(self, fileobj, protocol=PICKLE_PROTOCOL)
+        self.arrays = arrays
+        self._index = {}
+
+    def persistent_id(self, obj):
+        if not is_plain_array(obj):
+            return None
+        if id(obj) not in self._index:
+            self._index[id(obj)] = len(self.arrays)
+            self.arrays.append(obj)
+        return self._index[id(obj)]
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+
+    def __init__(self, fileobj, arrays):
+        pickle.Unpickler.__init__(self, fileobj)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        return self.arrays[pid]
+
+
+class NumpySerializer(Serializer):
+
+    """Pickles an object with its numpy arrays written in the raw .npy layout.
+
+    Like joblib, the arrays are not copied into the pickle stream.  The file
+    holds a header, every array in the .npy layout and finally the pickle of
+    the object, in which the arrays are replaced by their index.
+    """
+
+    name = 'numpy'
+    magic = b'\x93ESTNPK\x01'
+
+    def dump(self, obj, fileobj):
+        import numpy as np
+        arrays = []
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as skeleton:
+            _ArrayPickler(skeleton, arrays).dump(obj)
+            fileobj.write(self.magic)
+            fileobj.write(struct.pack('<Q', len(arrays)))
+            for array in arrays:
+                np.lib.format.write_array(fileobj, array, allow_pickle=False)
+            skeleton.seek(0)
+            shutil.copyfileobj(skeleton, fileobj, CHUNK_SIZE)
+
+    def load(self, fileobj, path=None):
+        import numpy as np
+        if fileobj.read(len(self.magic)) != self.magic:
+            raise ValueError('File is not in the %r format' % self.name)
+        n_arrays, = struct.unpack('<Q', fileobj.read(8))
+        arrays = [np.lib.format.read_array(fileobj, allow_pickle=False)
+                  for _ in range(n_arrays)]
+        return _ArrayUnpickler(fileobj, arrays).load()
+
+
+def register(serializer):
+    """register a serializer instance under its name"""
+    _registry[serializer.name] = serializer
+    return serializer
+
+
+def get_serializer(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError('Unknown serializer %r, choose from %s' % (name, list(_registry)))
+
+
+def choose_serializer(obj):
+    """return the serializer configured for the type of obj in
+    ``ESTIMATORS_SERIALIZERS``, or the default one"""
+    for klass in type(obj).__mro__:
+        name = SERIALIZERS.get('%s.%s' % (klass.__module__, klass.__name__))
+        if name is not None and get_serializer(name).accepts(obj):
+            return get_serializer(name)
+    return get_serializer(DEFAULT_SERIALIZER)
+
+
+def detect_serializer(fileobj):
+    """return the serializer of a file persisted without a recorded format,
+    using its leading bytes.  fileobj is rewound to its start."""
+    head = fileobj.read(16)
+    fileobj.seek(0)
+    for serializer in _registry.values():
+        if serializer.magic is not None and head.startswith(serializer.magic):
+            return serializer
+    return get_serializer('dill')
+
+
+register(DillSerializer())
+register(PickleSerializer())
+register(NumpySerializer())
+register(NpySerializer(mmap_mode=MMAP_MODE))
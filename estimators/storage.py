@@ -0,0 +1,450 @@
+"""
+Storage backends of the object files.
+
+``CachedStorage`` keeps a local disk copy of the files it reads from another
+storage, typically an object storage, so that hosts download each file once.
+Files are named after the hash of their object and never change, so a cached
+copy never goes stale.
+
+``PackStorage`` appends small objects to large pack files, rather than storing
+each of them as a file of its own.  Every pack file has an index file, to which
+a line ``name, offset, length, time`` is appended once the object is written.
+Indexes are append-only, and a deleted object is recorded as a line with a
+length of -1, so processes pick up each other's writes by reading the lines
+appended since they last read an index.  Appends and compactions hold an
+exclusive lock on the pack directory.
+
+``save_object_file`` writes the object files to any storage, skipping files
+that are stored already, and writing the files of local storages atomically.
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+from estimators import (CHUNK_SIZE, DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES, DISK_CACHE_STORAGE, PACK_DIR,
+                        PACK_MAX_BYTES, PACK_THRESHOLD)
+from estimators.locks import file_lock
+
+PACK_NAME = 'pack-%08d'
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+# length of the index lines of deleted objects
+DELETED = -1
+
+
+def save_object_file(storage, name, content):
+    """write content to the storage under name, unless a file is stored there already,
+    and return name.  Object files are named after the hash of their content, so a stored
+    file is never written again.
+
+    Files of a FileSystemStorage are written to a temporary file renamed once complete,
+    so that a stored file is always complete, and writers racing on a same name both
+    leave a single file.  Other storages are expected to store files atomically, like
+    object storages do, and the copy saved under another name, by a writer that lost a
+    race, is deleted."""
+    if storage.exists(name):
+        return name
+    if isinstance(storage, FileSystemStorage):
+        _write_local_file(storage, name, content)
+        return name
+    saved_name = storage.save(name, content)
+    if saved_name != name:
+        storage.delete(saved_name)
+    return name
+
+
+def _write_local_file(storage, name, content):
+    path = storage.path(name)
+    directory, file_name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, '.tmp-%s-%s' % (file_name, uuid.uuid4().hex))
+    # created with the permissions of the files of the storage, unlike mkstemp
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        if storage.file_permissions_mode is not None:
+            os.chmod(temp_path, storage.file_permissions_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _index_lines(entries):
+    """return the index lines of (name, offset, length, time) entries"""
+    return ''.join('%s\t%d\t%d\t%f\n' % entry for entry in entries).encode('utf-8')
+
+
+@deconstructible
+class PackStorage(Storage):
+
+    """Stores objects up to threshold bytes in pack files in location, and larger
+    objects in the inner storage, by default django's default_storage.
+
+    Packed objects are read with a single seek in their pack file.  They have no
+    local path nor url.  Objects no longer referenced are removed by `compact`.
+    """
+
+    def __init__(self, location=None, threshold=None, max_pack_bytes=None, inner=None):
+        self.pack_location = location or PACK_DIR or os.path.join(settings.MEDIA_ROOT, 'packs')
+        self.threshold = PACK_THRESHOLD if threshold is None else threshold
+        self.max_pack_bytes = PACK_MAX_BYTES if max_pack_bytes is None else max_pack_bytes
+        self.inner = default_storage if inner is None else inner
+        # name -> (pack number, offset, length, time) of the packed objects
+        self._index = {}
+        # pack number -> number of bytes of its index already read
+        self._index_offsets = {}
+        self._index_lock = threading.Lock()
+
+    @property
+    def location(self):
+        return self.inner.location
+
+    def _path(self, number, suffix):
+        return os.path.join(self.pack_location, PACK_NAME % number + suffix)
+
+    def _lock(self):
+        os.makedirs(self.pack_location, exist_ok=True)
+        return file_lock(os.path.join(self.pack_location, 'packs.lock'))
+
+    def _pack_numbers(self):
+        if not os.path.isdir(self.pack_location):
+            return []
+        return sorted(int(file_name[len('pack-'):-len(INDEX_SUFFIX)])
+                      for file_name in os.listdir(self.pack_location)
+                      if file_name.startswith('pack-') and file_name.endswith(INDEX_SUFFIX))
+
+    def _refresh_index(self):
+        """read the index lines appended by any process since the last refresh"""
+        with self._index_lock:
+            self._read_indexes()
+
+    def _read_indexes(self):
+        numbers = self._pack_numbers()
+        live_numbers = set(numbers)
+        for number in set(self._index_offsets) - live_numbers:
+            del self._index_offsets[number]
+        # drop the entries of packs compacted away, including the ones saved by this instance
+        self._index = dict((name, entry) for name, entry in self._index.items() if entry[0] in live_numbers)
+        for number in numbers:
+            start = self._index_offsets.get(number, 0)
+            try:
+                with open(self._path(number, INDEX_SUFFIX), 'rb') as f:
+                    f.seek(start)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # a line being appended is read on the next refresh
+            data = data[:data.rfind(b'\n') + 1]
+            for line in data.splitlines():
+                name, offset, length, timestamp = line.decode('utf-8').split('\t')
+                if int(length) == DELETED:
+                    self._index.pop(name, None)
+                else:
+                    self._index[name] = (number, int(offset), int(length), float(timestamp))
+            self._index_offsets[number] = start + len(data)
+
+    def _lookup(self, name):
+        """return the index entry of a packed object, or None"""
+        entry = self._index.get(name)
+        # the entries of packs compacted away by another process are stale
+        if entry is None or not os.path.exists(self._path(entry[0], PACK_SUFFIX)):
+            self._refresh_index()
+            entry = self._index.get(name)
+        return entry
+
+    def _read(self, entry):
+        number, offset, length, _ = entry
+        with open(self._path(number, PACK_SUFFIX), 'rb', buffering=0) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _append_index(self, number, entries):
+        with open(self._path(number, INDEX_SUFFIX), 'ab') as f:
+            f.write(_index_lines(entries))
+
+    def _current_pack(self, size):
+        """return the number of the pack that size bytes are appended to"""
+        numbers = self._pack_numbers()
+        if not numbers:
+            return 0
+        pack_path = self._path(numbers[-1], PACK_SUFFIX)
+        pack_size = os.path.getsize(pack_path) if os.path.exists(pack_path) else 0
+        if pack_size and pack_size + size > self.max_pack_bytes:
+            return numbers[-1] + 1
+        return numbers[-1]
+
+    def _open(self, name, mode='rb'):
+        entry = self._lookup(name)
+        if entry is None:
+            return self.inner.open(name, mode)
+        try:
+            data = self._read(entry)
+        except FileNotFoundError:
+            # the pack was compacted meanwhile, the object may have moved
+            self._refresh_index()
+            entry = self._index.get(name)
+            if entry is None:
+                raise
+            data = self._read(entry)
+        return File(io.BytesIO(data), name=name)
+
+    def _save(self, name, content):
+        if content.size > self.threshold:
+            return save_object_file(self.inner, name, content)
+        data = b''.join(content.chunks())
+        with self._lock():
+            number = self._current_pack(len(data))
+            with open(self._path(number, PACK_SUFFIX), 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            # the index line is written last, so that it only refers to complete objects
+            entry = (number, offset, len(data), time.time())
+            self._append_index(number, [(name,) + entry[1:]])
+        with self._index_lock:
+            self._index[name] = entry
+        return name
+
+    def delete(self, name):
+        if self._lookup(name) is None:
+            return self.inner.delete(name)
+        with self._lock():
+            self._append_index(self._current_pack(0), [(name, 0, DELETED, time.time())])
+        with self._index_lock:
+            self._index.pop(name, None)
+
+    def exists(self, name):
+        return self._lookup(name) is not None or self.inner.exists(name)
+
+    def size(self, name):
+        entry = self._lookup(name)
+        if entry is None:
+            return self.inner.size(name)
+        return entry[2]
+
+    def path(self, name):
+        if self._lookup(name) is not None:
+            raise NotImplementedError('%r is stored in a pack file, it has no path' % name)
+        return self.inner.path(name)
+
+    def url(self, name):
+        if self._lookup(name) is not None:
+            raise NotImplementedError('%r is stored in a pack file, it has no url' % name)
+        return self.inner.url(name)
+
+    def listdir(self, path):
+        return self.inner.listdir(path)
+
+    def compact(self, live_names, min_age=3600):
+        """rewrite the pack files with only the objects named in live_names, or written
+        less than min_age seconds ago, so that objects persisted by rows not inserted yet
+        are kept.  Return the number of objects removed."""
+        live_names = set(live_names)
+        with self._lock():
+            self._refresh_index()
+            old_numbers = self._pack_numbers()
+            entries = sorted(self._index.items(), key=lambda item: item[1])
+            kept = [(name, entry) for name, entry in entries
+                    if name in live_names or entry[3] > time.time() - min_age]
+            number, pack, index = (old_numbers[-1] if old_numbers else -1), None, []
+            for name, entry in kept:
+                if pack is None or (pack.tell() and pack.tell() + entry[2] > self.max_pack_bytes):
+                    self._write_compacted(number, pack, index)
+                    number, pack, index = number + 1, open(self._path(number + 1, PACK_SUFFIX), 'wb'), []
+                index.append((name, pack.tell(), entry[2], entry[3]))
+                pack.write(self._read(entry))
+            self._write_compacted(number, pack, index)
+            # the new indexes are complete, readers now find the objects in the new packs
+            for old_number in old_numbers:
+                os.remove(self._path(old_number, INDEX_SUFFIX))
+                if os.path.exists(self._path(old_number, PACK_SUFFIX)):
+                    os.remove(self._path(old_number, PACK_SUFFIX))
+            self._refresh_index()
+        return len(entries) - len(kept)
+
+    def _write_compacted(self, number, pack, index):
+        """close a pack written by compact, then write its index at once"""
+        if pack is None:
+            return
+        pack.close()
+        index_path = self._path(number, INDEX_SUFFIX)
+        with open(index_path + '.tmp', 'wb') as f:
+            f.write(_index_lines(index))
+        os.replace(index_path + '.tmp', index_path)
+
+
+@deconstructible
+class CachedStorage(Storage):
+
+    """Reads the files of the inner storage through a local disk cache in location.
+
+    A file is copied to the cache the first time it is opened, into a temporary
+    file renamed once complete, while holding a lock shared by the processes of the
+    host, so that each file is downloaded once.  The least recently used files are
+    evicted once the cache exceeds max_bytes, except those used less than min_age
+    seconds ago, which may be about to be opened by their path.
+
+    The total size of the cache is kept in a file shared by the processes of the host,
+    so that the cache is only walked to evict files once it exceeds max_bytes.  The walk
+    measures the total again, correcting the drift of processes that crashed mid-fill.
+    """
+
+    # number of lock files the file names are spread over
+    lock_stripes = 256
+
+    def __init__(self, location=None, max_bytes=None, inner=None, min_age=60):
+        default_location = os.path.join(tempfile.gettempdir(), 'estimators-cache')
+        self.cache_location = location or DISK_CACHE_DIR or default_location
+        self.max_bytes = DISK_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        if inner is None:
+            inner = import_string(DISK_CACHE_STORAGE)() if DISK_CACHE_STORAGE else default_storage
+        self.inner = inner
+        self.min_age = min_age
+
+    @property
+    def location(self):
+        return getattr(self.inner, 'location', self.cache_location)
+
+    def _cache_path(self, name):
+        return safe_join(self.cache_location, name)
+
+    def _lock(self, name=None):
+        """return the lock of filling name, or of evicting files if name is None"""
+        lock_dir = os.path.join(self.cache_location, '.locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        if name is None:
+            return file_lock(os.path.join(lock_dir, 'evict.lock'))
+        stripe = zlib.crc32(name.encode('utf-8')) % self.lock_stripes
+        return file_lock(os.path.join(lock_dir, '%02x.lock' % stripe))
+
+    def _cached(self, name):
+        """return the path of the cached copy of name, filled from the inner storage if
+        needed, and mark it as recently used"""
+        cache_path = self._cache_path(name)
+        if not os.path.exists(cache_path):
+            filled = None
+            with self._lock(name):
+                if not os.path.exists(cache_path):
+                    filled = self._fill(name, cache_path)
+            if filled is not None:
+                total = self._add_bytes(filled)
+                if total is None or total > self.max_bytes:
+                    self._evict(keep=cache_path)
+        try:
+            os.utime(cache_path)
+        except FileNotFoundError:
+            # evicted meanwhile by another process
+            return self._cached(name)
+        return cache_path
+
+    def _fill(self, name, cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, 'wb') as temp, self.inner.open(name, 'rb') as f:
+                shutil.copyfileobj(f, temp, CHUNK_SIZE)
+                size = temp.tell()
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return size
+
+    def _size_path(self):
+        return os.path.join(self.cache_location, '.locks', 'size')
+
+    def _add_bytes(self, delta):
+        """add delta to the total size of the cache and return it, or None if the total
+        is not known, before the first eviction walk"""
+        with self._lock():
+            try:
+                with open(self._size_path()) as f:
+                    total = int(f.read()) + delta
+            except (FileNotFoundError, ValueError):
+                return None
+            self._write_total(total)
+        return total
+
+    def _write_total(self, total):
+        with open(self._size_path(), 'w') as f:
+            f.write('%d' % total)
+
+    def _cached_files(self):
+        """return the (last use, size, path) of the cached files"""
+        files = []
+        for dir_path, dir_names, file_names in os.walk(self.cache_location):
+            dir_names[:] = [dir_name for dir_name in dir_names if dir_name != '.locks']
+            for file_name in file_names:
+                if file_name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self, keep=None):
+        """remove the least recently used files until the cache fits in max_bytes"""
+        with self._lock():
+            files = sorted(self._cached_files())
+            total = sum(size for _, size, _ in files)
+            recent = time.time() - self.min_age
+            for last_use, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                if path == keep or last_use > recent:
+                    continue
+                os.remove(path)
+                total -= size
+            self._write_total(total)
+
+    def _open(self, name, mode='rb'):
+        return File(open(self._cached(name), mode), name=name)
+
+    def _save(self, name, content):
+        return save_object_file(self.inner, name, content)
+
+    def path(self, name):
+        """return the local path of the cached copy of name"""
+        return self._cached(name)
+
+    def delete(self, name):
+        self.inner.delete(name)
+        cache_path = self._cache_path(name)
+        try:
+            size = os.path.getsize(cache_path)
+            os.remove(cache_path)
+        except FileNotFoundError:
+            return
+        self._add_bytes(-size)
+
+    def exists(self, name):
+        return os.path.exists(self._cache_path(name)) or self.inner.exists(name)
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self._cache_path(name))
+        except FileNotFoundError:
+            return self.inner.size(name)
+
+    def url(self, name):
+        return self.inner.url(name)
+
+    def listdir(self, path):
+        return self.inner.listdir(path)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from estimators.models import base
+from estimators.models.datasets import DataSet
+from estimators.models.estimators import Estimator
+
+
+@pytest.mark.django_db
+class TestBulkGetOrCreate():
+
+    def test_bulk_get_or_create(self):
+        existing = DataSet(data=np.arange(30))
+        existing.save()
+        objs = [np.arange(30), np.arange(40), np.arange(50)]
+
+        results = DataSet.objects.bulk_get_or_create(objs)
+
+        assert [created for _, created in results] == [False, True, True]
+        assert results[0][0] == existing
+        assert DataSet.objects.count() == 3
+        for (ds, _), obj in zip(results, objs):
+            assert ds.pk is not None
+            assert ds.object_hash == DataSet._compute_hash(obj)
+            assert np.array_equal(DataSet.objects.get(pk=ds.pk).data, obj)
+
+    def test_bulk_get_or_create_queries(self, django_assert_num_queries):
+        Estimator(estimator='existing').save()
+        objs = ['existing'] + ['estimator_%d' % i for i in range(20)]
+        # the lookup, the recheck and the insert within a savepoint, and the primary keys
+        with django_assert_num_queries(6):
+            results = Estimator.objects.bulk_get_or_create(objs)
+        assert sum(created for _, created in results) == 20
+        assert all(e.is_file_persisted for e, _ in results)
+
+    def test_bulk_get_or_create_duplicates(self):
+        results = Estimator.objects.bulk_get_or_create(['twice', 'twice'])
+        assert [created for _, created in results] == [True, False]
+        assert results[0][0] is results[1][0]
+        assert Estimator.objects.count() == 1
+
+    def test_bulk_get_or_create_mixed_hash_schemes(self, monkeypatch):
+        md5 = Estimator(estimator='md5_object')
+        md5.save()
+        monkeypatch.setattr(base, 'HASH_SCHEME', 'sha256')
+        monkeypatch.setattr(base, 'LOOKUP_HASH_SCHEMES', ('sha256', 'md5'))
+
+        results = Estimator.objects.bulk_get_or_create(['md5_object', 'sha256_object'])
+        assert results[0] == (md5, False)
+        assert results[1][0].hash_scheme == 'sha256'
+        assert results[1][1] == True
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+
+import pytest
+
+from estimators.cache import ObjectCache, SingleFlight, object_cache, object_loads
+from estimators.models import base
+from estimators.models.estimators import Estimator
+from estimators.serializers import DillSerializer
+
+
+class TestObjectCache():
+
+    def test_disabled_cache(self):
+        cache = ObjectCache(max_bytes=0)
+        assert cache.set('a', 'object_a', 1) is False
+        assert cache.get('a') is None
+        assert cache.stats()['misses'] == 0
+
+    def test_hits_and_misses(self):
+        cache = ObjectCache(max_bytes=10)
+        cache.set('a', 'object_a', 4)
+        assert cache.get('a') == 'object_a'
+        assert cache.get('b') is None
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_lru_eviction(self):
+        cache = ObjectCache(max_bytes=10)
+        cache.set('a', 'object_a', 4)
+        cache.set('b', 'object_b', 4)
+        # touch 'a' so that 'b' becomes the least recently used
+        cache.get('a')
+        cache.set('c', 'object_c', 4)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert cache.current_bytes == 8
+
+    def test_oversized_object_not_cached(self):
+        cache = ObjectCache(max_bytes=10)
+        assert cache.set('a', 'object_a', 11) is False
+        assert len(cache) == 0
+
+
+@pytest.mark.django_db
+class TestLoadWithCache():
+
+    @pytest.fixture(autouse=True)
+    def enabled_cache(self, monkeypatch):
+        monkeypatch.setattr(object_cache, 'max_bytes', 2 ** 20)
+        object_cache.clear()
+        yield
+        object_cache.clear()
+
+    def test_load_uses_cache(self):
+        Estimator(estimator='cached_object').save()
+
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash('cached_object'))
+        assert e.estimator == 'cached_object'
+        assert object_cache.misses == 1
+
+        f = Estimator.objects.get(pk=e.pk)
+        assert f.estimator is e.estimator
+        assert object_cache.hits == 1
+
+    def test_load_does_not_ask_storage_for_size(self, monkeypatch):
+        Estimator(estimator='sized_object').save()
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash('sized_object'))
+
+        def size(name):
+            raise AssertionError('the recorded size is used')
+        monkeypatch.setattr(e.object_file.storage, 'size', size)
+        assert e.estimator == 'sized_object'
+        assert object_cache.current_bytes == e.object_size
+
+        # nor does it with the cache disabled
+        object_cache.clear()
+        monkeypatch.setattr(object_cache, 'max_bytes', 0)
+        assert Estimator.objects.get(pk=e.pk).estimator == 'sized_object'
+
+
+class TestSingleFlight():
+
+    def test_concurrent_calls_share_a_result(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def func():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', func))) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len(results) == 5 and all(r is results[0] for r in results)
+        assert len(flight) == 0
+
+        # calls made once the first is done run again
+        flight.do('key', func)
+        assert len(calls) == 2
+
+    def test_error_is_raised_and_not_kept(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('load failed')
+        with pytest.raises(ValueError):
+            flight.do('key', fail)
+        assert flight.do('key', lambda: 'loaded') == 'loaded'
+
+
+@pytest.mark.django_db
+class TestSingleFlightLoad():
+
+    @pytest.fixture
+    def slow_loads(self, monkeypatch):
+        loads = []
+        original = DillSerializer.load
+
+        def load(serializer, f, path=None):
+            loads.append(path)
+            time.sleep(0.2)
+            return original(serializer, f, path=path)
+        monkeypatch.setattr(DillSerializer, 'load', load)
+        return loads
+
+    def load_concurrently(self, instances):
+        objects = []
+        threads = [threading.Thread(target=lambda e=e: objects.append(e.estimator)) for e in instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return objects
+
+    def test_concurrent_loads_deserialize_once(self, slow_loads):
+        Estimator(estimator=['popular', 'estimator']).save()
+        pk = Estimator.objects.get(object_hash=Estimator._compute_hash(['popular', 'estimator'])).pk
+        instances = [Estimator.objects.get(pk=pk) for _ in range(10)]
+
+        objects = self.load_concurrently(instances)
+        assert len(slow_loads) == 1
+        assert len(objects) == 10 and all(o is objects[0] for o in objects)
+        assert objects[0] == ['popular', 'estimator']
+        assert len(object_loads) == 0
+
+    def test_loads_locked_between_processes(self, slow_loads, monkeypatch, tmpdir):
+        monkeypatch.setattr(base, 'LOAD_LOCK_DIR', str(tmpdir))
+        Estimator(estimator=['locked', 'estimator']).save()
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash(['locked', 'estimator']))
+
+        assert self.load_concurrently([e, Estimator.objects.get(pk=e.pk)])[0] == ['locked', 'estimator']
+        assert len(slow_loads) == 1
+        assert os.listdir(str(tmpdir)) == ['%s.lock' % e.object_hash]
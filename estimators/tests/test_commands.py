@@ -0,0 +1,94 @@
+import hashlib
+import os
+
+import pytest
+from django.core.management import call_command
+
+from estimators.models.datasets import DataSet
+from estimators.models.estimators import Estimator
+
+
+@pytest.mark.django_db
+class TestRehashObjects():
+
+    def test_rehash_objects(self):
+        Estimator(estimator='md5_estimator').save()
+        DataSet(data=['md5', 'dataset']).save()
+        old_path = Estimator.objects.get().file_path
+
+        call_command('rehash_objects', hash_scheme='sha256', batch_size=1)
+
+        e = Estimator.objects.get()
+        assert e.hash_scheme == 'sha256'
+        assert e.object_hash == Estimator._compute_hash('md5_estimator', 'sha256')
+        assert e.object_file.name.endswith(e.object_hash)
+        assert e.estimator == 'md5_estimator'
+        assert not os.path.exists(old_path)
+
+        ds = DataSet.objects.get()
+        assert ds.hash_scheme == 'sha256'
+        assert ds.data == ['md5', 'dataset']
+
+    def test_rehash_objects_to_content_scheme(self):
+        Estimator(estimator='md5_estimator').save()
+
+        call_command('rehash_objects', hash_scheme='sha256+content')
+
+        e = Estimator.objects.get()
+        assert e.hash_scheme == 'sha256+content'
+        with open(e.file_path, 'rb') as f:
+            assert hashlib.sha256(f.read()).hexdigest() == e.object_hash
+        assert e.estimator == 'md5_estimator'
+        assert e.object_size == os.path.getsize(e.file_path)
+        assert e.object_type == 'builtins.str'
+
+    def test_rehash_objects_records_metadata(self):
+        Estimator(estimator='stale_metadata').save()
+        # rows persisted before the metadata were recorded
+        Estimator.objects.update(object_size=None, object_type='')
+
+        call_command('rehash_objects', hash_scheme='sha256+content')
+
+        e = Estimator.objects.get()
+        assert e.object_size == os.path.getsize(e.file_path)
+        assert e.object_type == 'builtins.str'
+
+
+@pytest.mark.django_db
+class TestShardObjects():
+
+    def test_shard_objects(self, monkeypatch):
+        import estimators
+        Estimator(estimator='flat_estimator').save()
+        DataSet(data=['flat', 'dataset']).save()
+        e = Estimator.objects.get()
+        old_path = e.file_path
+        assert e.object_file.name == 'estimators/%s' % e.object_hash
+
+        call_command('shard_objects', depth=2, width=2, batch_size=1)
+
+        e = Estimator.objects.get()
+        h = e.object_hash
+        assert e.object_file.name == 'estimators/%s/%s/%s' % (h[:2], h[2:4], h)
+        assert e.estimator == 'flat_estimator'
+        assert not os.path.exists(old_path)
+        assert DataSet.objects.get().data == ['flat', 'dataset']
+
+        # the new layout is used once configured, and the moved files are found
+        monkeypatch.setattr(estimators, 'SHARD_DEPTH', 2)
+        n = Estimator(estimator='flat_estimator')
+        assert n.upload_path == e.object_file.name
+        assert n.is_file_persisted
+
+        call_command('shard_objects', depth=0)
+        assert Estimator.objects.get().object_file.name == 'estimators/%s' % h
+        assert Estimator.objects.get().estimator == 'flat_estimator'
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps'), reason='needs the /proc of Linux')
+class TestMemoryUsage():
+
+    def test_memory_usage(self, capsys):
+        call_command('memory_usage', str(os.getpid()))
+        out = capsys.readouterr()[0]
+        assert out.splitlines()[1].split()[0] == str(os.getpid())
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from estimators.models.datasets import DataSet
+from estimators.serializers import NPY_MAGIC
+
+
+@pytest.mark.django_db
+class TestDataSet():
+
+    def test_array_persisted_as_npy(self):
+        arr = np.arange(1000, dtype=np.float64).reshape(100, 10)
+        ds = DataSet(data=arr)
+        ds.save()
+
+        with open(ds.file_path, 'rb') as f:
+            assert f.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+    def test_array_loaded_memory_mapped(self):
+        arr = np.arange(1000, dtype=np.int32).reshape(100, 10)
+        DataSet(data=arr).save()
+        object_hash = DataSet._compute_hash(arr)
+
+        ds = DataSet.objects.get(object_hash=object_hash)
+        assert isinstance(ds.data, np.memmap)
+        assert np.array_equal(ds.data, arr)
+        # a memory-mapped array still resolves to the same DataSet
+        assert DataSet.objects.filter(data=ds.data).first() == ds
+
+    def test_object_array_persisted_with_dill(self):
+        arr = np.array(['a', None, 1], dtype=object)
+        DataSet(data=arr).save()
+
+        ds = DataSet.objects.get(object_hash=DataSet._compute_hash(arr))
+        assert not isinstance(ds.data, np.memmap)
+        assert list(ds.data) == ['a', None, 1]
+
+    def test_metadata_recorded(self):
+        arr = np.zeros((20, 4), dtype=np.float32)
+        DataSet(data=arr).save()
+
+        ds = DataSet.objects.get(object_hash=DataSet._compute_hash(arr))
+        assert ds.object_type == 'numpy.ndarray'
+        assert ds.object_shape == '(20, 4)'
+        assert ds.object_dtype == 'float32'
+        assert ds.object_size == ds.object_file.storage.size(ds.upload_path)
+        assert ds.object_columns == ''
+
+    def test_frame_metadata_recorded(self):
+        pd = pytest.importorskip('pandas')
+        frame = pd.DataFrame({'a': [1, 2], 'b': [0.5, 1.5], 'c': ['x', 'y']})
+        ds = DataSet(data=frame)
+        ds.save()
+        # the module of DataFrame depends on the version of pandas
+        assert ds.object_type == '%s.%s' % (type(frame).__module__, type(frame).__qualname__)
+        assert ds.object_shape == '(2, 3)'
+        # the dtype of string columns depends on the version of pandas too
+        assert ds.object_dtype == ','.join(sorted(set(str(d) for d in frame.dtypes)))
+        assert 'float64' in ds.object_dtype and 'int64' in ds.object_dtype
+        assert ds.object_columns == 'a,b,c'
+
+    def test_persist_none(self):
+        DataSet(data=None).save()
+        ds = DataSet.objects.get(object_hash=DataSet._compute_hash(None))
+        assert ds.is_file_persisted
+        assert ds.data is None
+
+    def test_reassign_data_of_stored_row(self):
+        DataSet(data=[1, 2, 3]).save()
+        ds = DataSet.objects.get(object_hash=DataSet._compute_hash([1, 2, 3]))
+        assert ds.persisted_at is not None
+        ds.data = [4, 5, 6]
+        ds.save()
+
+        ds = DataSet.objects.get(pk=ds.pk)
+        assert ds.object_hash == DataSet._compute_hash([4, 5, 6])
+        assert ds.is_file_persisted
+        assert ds.data == [4, 5, 6]
+        assert ds.object_size == ds.object_file.storage.size(ds.upload_path)
+
+    def test_listing_does_not_load_objects(self, django_assert_num_queries):
+        for i in range(5):
+            DataSet(data=np.arange(i + 100)).save()
+        with django_assert_num_queries(1):
+            datasets = list(DataSet.objects.all())
+            descriptions = [repr(ds) + str(ds) for ds in datasets]
+        assert all(ds._data is None for ds in datasets)
+        assert 'numpy.ndarray, shape (100,), int64' in descriptions[0]
+
+    def test_admin_registrations(self):
+        from django.contrib import admin
+        for model_admin in admin.site._registry.values():
+            assert model_admin.check() == []
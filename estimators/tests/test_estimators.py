@@ -1,11 +1,37 @@
+import asyncio
+
+import hashlib
+import os
+import tracemalloc
 
 import pytest
 from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 
+from estimators.models import base
 from estimators.models.estimators import Estimator
+from estimators.serializers import DillSerializer
 from estimators.tests.factories import EstimatorFactory
 
 
+class RemoteStorage(FileSystemStorage):
+
+    """A file system storage that hides its local paths, like remote storages"""
+
+    def path(self, name):
+        raise NotImplementedError()
+
+    def exists(self, name):
+        return os.path.exists(super().path(name))
+
+    def size(self, name):
+        return os.path.getsize(super().path(name))
+
+    def _open(self, name, mode='rb'):
+        return File(open(super().path(name), mode))
+
+
 @pytest.mark.django_db
 class TestEstimator():
 
@@ -96,3 +122,148 @@ class TestEstimator():
         assert e.is_file_persisted == True
         e.save()
         assert e.object_file.name.endswith(hash_of_yes)
+
+    def test_persist_memory_bounded_by_chunk_size(self):
+        # 16 MB of payload, made of 64 KB chunks
+        obj = [bytes([i]) * 2 ** 16 for i in range(256)]
+        m = Estimator(estimator=obj)
+
+        tracemalloc.start()
+        m.persist()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert m.object_file.size > 2 ** 24
+        assert peak < 2 ** 23
+
+    def test_load_from_storage_without_local_path(self):
+        Estimator(estimator='remote_object').save()
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash('remote_object'))
+        e.object_file.storage = RemoteStorage(location=e.object_file.storage.location)
+        assert e.estimator == 'remote_object'
+
+    def test_configured_hash_scheme(self, monkeypatch):
+        monkeypatch.setattr(base, 'HASH_SCHEME', 'sha256')
+        m = Estimator(estimator='sha256_object')
+        m.save()
+        assert m.hash_scheme == 'sha256'
+        assert len(m.object_hash) == 64
+
+    def test_mixed_hash_schemes(self, monkeypatch):
+        m = Estimator(estimator='md5_object')
+        m.save()
+        monkeypatch.setattr(base, 'HASH_SCHEME', 'blake2b')
+        monkeypatch.setattr(base, 'LOOKUP_HASH_SCHEMES', ('blake2b', 'md5'))
+
+        assert Estimator.objects.filter(estimator='md5_object').get() == m
+        n, created = Estimator.objects.get_or_create(estimator='md5_object')
+        assert n == m
+        assert created == False
+
+        o, created = Estimator.objects.get_or_create(estimator='blake2b_object')
+        assert created == True
+        assert o.hash_scheme == 'blake2b'
+        assert len(o.object_hash) == 128
+
+    def count_hashes(self, monkeypatch):
+        calls = []
+        hash_func = base.hashing.hash
+
+        def counting_hash(obj, *args, **kwargs):
+            calls.append(obj)
+            return hash_func(obj, *args, **kwargs)
+        monkeypatch.setattr(base.hashing, 'hash', counting_hash)
+        return calls
+
+    def test_object_hashed_once_on_save(self, monkeypatch):
+        calls = self.count_hashes(monkeypatch)
+        Estimator(estimator='hashed_once').save()
+        assert len(calls) == 1
+
+    def test_object_hashed_once_on_get_or_create(self, monkeypatch):
+        calls = self.count_hashes(monkeypatch)
+        Estimator.objects.get_or_create(estimator='hashed_once')
+        assert len(calls) == 1
+        Estimator.objects.get_or_create(estimator='hashed_once')
+        assert len(calls) == 2
+
+    def test_loaded_object_not_rehashed(self, monkeypatch):
+        Estimator(estimator='loaded_object').save()
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash('loaded_object'))
+        calls = self.count_hashes(monkeypatch)
+        assert e.estimator == 'loaded_object'
+        e.description = 'updated description'
+        e.save()
+        assert calls == []
+
+    def test_content_hash_scheme(self, monkeypatch):
+        monkeypatch.setattr(base, 'HASH_SCHEME', 'sha256+content')
+        monkeypatch.setattr(base, 'LOOKUP_HASH_SCHEMES', ('sha256+content',))
+        dumps = []
+        dump = DillSerializer.dump
+        monkeypatch.setattr(DillSerializer, 'dump', lambda self, obj, f: dumps.append(obj) or dump(self, obj, f))
+
+        m, created = Estimator.objects.get_or_create(estimator='content_object')
+        assert created == True
+        assert len(dumps) == 1
+        with open(m.file_path, 'rb') as f:
+            assert hashlib.sha256(f.read()).hexdigest() == m.object_hash
+
+        Estimator(estimator='other_content_object').save()
+        assert len(dumps) == 2
+        assert Estimator.objects.filter(estimator='content_object').get() == m
+
+    def test_save_persisted_row_without_storage_check(self, monkeypatch):
+        Estimator(estimator='known_good').save()
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash('known_good'))
+        assert e.persisted_at is not None
+
+        def exists(name):
+            raise AssertionError('the storage should not be checked')
+        monkeypatch.setattr(e.object_file.storage, 'exists', exists)
+        e.description = 'updated description'
+        e.save()
+        assert e._estimator is None
+        assert Estimator.objects.get(pk=e.pk).description == 'updated description'
+
+    def test_missing_files(self):
+        for name in ('kept', 'lost'):
+            Estimator(estimator=name).save()
+        lost = Estimator.objects.get(object_hash=Estimator._compute_hash('lost'))
+        os.remove(lost.file_path)
+        assert Estimator.objects.missing_files(batch_size=1) == [lost]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestEstimatorAsync():
+
+    def run(self, future):
+        return asyncio.get_event_loop().run_until_complete(future)
+
+    def test_asave_and_aload(self):
+        m = Estimator(estimator='async_object')
+        self.run(m.asave())
+        assert m.pk is not None
+        assert m.is_file_persisted
+
+        e = Estimator.objects.get(pk=m.pk)
+        assert e._estimator is None
+        self.run(e.aload())
+        assert e._estimator == 'async_object'
+
+        e = Estimator.objects.get(pk=m.pk)
+        assert self.run(e.aget_object()) == 'async_object'
+        assert self.run(e.aget_object()) == 'async_object'
+
+    def test_aget_or_create(self):
+        m, created = self.run(Estimator.objects.aget_or_create(estimator='async_created'))
+        assert created
+        m2, created = self.run(Estimator.objects.aget_or_create(estimator='async_created'))
+        assert not created
+        assert m2 == m
+
+        m3, created = self.run(Estimator.objects.aupdate_or_create(
+            estimator='async_created', defaults={'description': 'updated'}))
+        assert not created
+        assert m3 == m
+        assert Estimator.objects.get(pk=m.pk).description == 'updated'
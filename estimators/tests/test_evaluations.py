@@ -49,3 +49,164 @@ class TestEvaluation():
         assert os.path.exists(er._y_test_proxy.object_file.path) is True
         assert os.path.exists(
             er._y_predicted_proxy.object_file.path) is True
+
+    def test_unsupervised_evaluation(self):
+        import numpy as np
+        from sklearn.cluster import KMeans
+        from estimators.models import EvaluationResult, Evaluator
+
+        X = np.arange(40, dtype=np.float64).reshape(20, 2)
+        km = KMeans(n_clusters=2, random_state=0).fit(X)
+        er = Evaluator(estimator=km, X_test=X).evaluate()
+
+        er = EvaluationResult.objects.get(pk=er.pk)
+        assert er.y_test is None
+        assert np.array_equal(er.y_predicted, km.predict(X))
+
+    def test_persist_results(self, django_assert_num_queries):
+        import numpy as np
+        from estimators.models import DataSet, Estimator, EvaluationResult, Evaluator
+
+        X_test = np.arange(60).reshape(20, 3)
+        existing = DataSet(data=X_test)
+        existing.save()
+        er = EvaluationResult(
+            estimator='persisted estimator', X_test=X_test, y_test=np.arange(20) % 2,
+            y_predicted=np.ones(20))
+
+        # one lookup per table, then within one transaction the inserts of each table with
+        # their recheck and primary keys, and the insert of the result
+        with django_assert_num_queries(15):
+            Evaluator().persist_results(er)
+
+        er = EvaluationResult.objects.get(pk=er.pk)
+        assert er._X_test_proxy == existing
+        assert er.estimator == 'persisted estimator'
+        assert np.array_equal(er.y_predicted, np.ones(20))
+        assert DataSet.objects.count() == 3
+        assert Estimator.objects.count() == 1
+
+    def test_evaluate_hashes_objects_once(self, monkeypatch):
+        import numpy as np
+        from sklearn.dummy import DummyClassifier
+        from estimators import hashing
+        from estimators.models import EvaluationResult, Evaluator
+
+        X = np.arange(40).reshape(20, 2)
+        y = np.arange(20) % 3
+        estimator = DummyClassifier(strategy='most_frequent').fit(X, y)
+        hashed = []
+        hash_object = hashing.hash
+        monkeypatch.setattr(hashing, 'hash', lambda obj, **kwargs: hashed.append(obj) or hash_object(obj, **kwargs))
+
+        evaluator = Evaluator(estimator=estimator, X_test=X, y_test=y)
+        assert [obj for obj in hashed if obj is not None] == [estimator, X, y]
+        del hashed[:]
+        er = evaluator.evaluate()
+        # only the predictions are hashed, once
+        assert len(hashed) == 1
+        assert EvaluationResult.objects.get(pk=er.pk).estimator is not None
+
+    def test_evaluate_many_without_persisting(self):
+        import numpy as np
+        from sklearn.dummy import DummyClassifier
+        from estimators.models import DataSet, Estimator, EvaluationResult, Evaluator
+
+        X = np.arange(40).reshape(20, 2) * 7
+        y = np.arange(20) % 2
+        estimator = DummyClassifier(strategy='most_frequent').fit(X, y)
+
+        results = Evaluator.evaluate_many([estimator], [(X, y)], persist=False, n_jobs=1)
+        assert np.array_equal(results[0].y_predicted, estimator.predict(X))
+        assert not os.path.exists(results[0]._X_test_proxy.file_path)
+        assert Estimator.objects.count() == 0
+        assert DataSet.objects.count() == 0
+        assert EvaluationResult.objects.count() == 0
+
+    @pytest.mark.parametrize('n_jobs', [1, 2])
+    def test_evaluate_many(self, n_jobs):
+        import numpy as np
+        from sklearn.dummy import DummyClassifier
+        from estimators.models import DataSet, EvaluationResult, Evaluator
+
+        X = np.arange(40).reshape(20, 2)
+        y = np.arange(20) % 3
+        estimators = [DummyClassifier(strategy=strategy).fit(X, y) for strategy in ('most_frequent', 'prior')]
+        X_test = DataSet(data=X[:10] + n_jobs)
+        X_test.save()
+        datasets = [(X_test, y[:10]), (X[10:] * n_jobs, y[10:])]
+        reports = []
+
+        results = Evaluator.evaluate_many(estimators, datasets, n_jobs=n_jobs, progress=reports.append)
+
+        assert len(results) == 4
+        assert results[0]._X_test_proxy == X_test
+        assert [r.completed for r in reports] == [1, 2, 3, 4]
+        assert all(r.total == 4 and r.predict_seconds >= 0 for r in reports)
+        assert np.array_equal(results[1].y_predicted, estimators[0].predict(X[10:]))
+        assert EvaluationResult.objects.count() == 4
+        er = EvaluationResult.objects.order_by('pk').last()
+        assert np.array_equal(er.y_predicted, estimators[1].predict(X[10:]))
+        assert np.array_equal(er.y_test, y[10:])
+
+    @pytest.mark.parametrize('n_jobs,backend', [(None, 'threads'), (3, 'threads'), (2, 'processes')])
+    def test_evaluate_in_batches(self, n_jobs, backend):
+        import numpy as np
+        from sklearn.linear_model import LinearRegression
+        from estimators.models import DataSet, Evaluator
+
+        X = np.random.RandomState(0).rand(100, 3)
+        y = X.dot([1.0, 2.0, 3.0])
+        lr = LinearRegression().fit(X, y)
+        X_test = DataSet(data=X)
+        X_test.save()
+        X_test = DataSet.objects.get(pk=X_test.pk)
+        assert isinstance(X_test.data, np.memmap)
+
+        er = Evaluator(estimator=lr, X_test=X_test, y_test=y).evaluate(
+            persist=False, batch_size=7, n_jobs=n_jobs, backend=backend)
+        assert np.allclose(er.y_predicted, lr.predict(X))
+
+    def test_evaluate_no_rows_in_batches(self):
+        import numpy as np
+        from sklearn.linear_model import LinearRegression
+        from estimators.models import Evaluator
+
+        X = np.random.RandomState(0).rand(10, 3)
+        lr = LinearRegression().fit(X, X.sum(axis=1))
+        # the estimator's own error, rather than an IndexError on the missing chunks
+        with pytest.raises(ValueError):
+            Evaluator(estimator=lr, X_test=X[:0], y_test=[]).evaluate(persist=False, batch_size=4)
+
+    def test_evaluate_unknown_backend(self):
+        from estimators.models import Evaluator
+        with pytest.raises(ValueError):
+            Evaluator(estimator=None, X_test=[1, 2], y_test=[1, 2]).evaluate(batch_size=1, n_jobs=2, backend='gpu')
+
+    def test_evaluate_cached(self, monkeypatch):
+        import numpy as np
+        from sklearn.dummy import DummyClassifier
+        from estimators.models import EvaluationResult, Evaluator, evaluations
+
+        monkeypatch.setattr(evaluations, 'CACHE_EVALUATIONS', True)
+        X = np.arange(30).reshape(15, 2)
+        y = np.arange(15) % 2
+        estimator = DummyClassifier(strategy='most_frequent').fit(X, y)
+        predictions = []
+        predict = DummyClassifier.predict
+        monkeypatch.setattr(DummyClassifier, 'predict', lambda self, X: predictions.append(X) or predict(self, X))
+
+        er = Evaluator(estimator=estimator, X_test=X, y_test=y).evaluate()
+        assert Evaluator(estimator=estimator, X_test=X, y_test=y).evaluate() == er
+        assert len(predictions) == 1
+
+        other = Evaluator(estimator=estimator, X_test=X, y_test=1 - y).evaluate()
+        assert len(predictions) == 1
+        assert other != er
+        assert other._y_predicted_proxy == er._y_predicted_proxy
+        assert np.array_equal(other.y_test, 1 - y)
+
+        forced = Evaluator(estimator=estimator, X_test=X, y_test=y).evaluate(force=True)
+        assert len(predictions) == 2
+        assert forced != er
+        assert EvaluationResult.objects.count() == 3
@@ -0,0 +1,143 @@
+import hashlib
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from estimators import hashing
+
+PYTHON_OBJECTS = [
+    'abcd',
+    object,
+    {'b': [1, 2, 3], 'a': ('x', 'y')},
+    {1, 2, 3},
+]
+
+NUMPY_OBJECTS = [
+    np.arange(100).reshape(10, 10),
+    {'weights': np.arange(10.0), 'labels': ['a', 'b'] * 1000},
+]
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+class TestStreamingHasher():
+
+    @pytest.mark.parametrize('obj', PYTHON_OBJECTS + NUMPY_OBJECTS)
+    def test_same_digest(self, obj):
+        assert hashing.hash(obj, stream=True) == hashing.hash(obj)
+
+    @pytest.mark.parametrize('obj', PYTHON_OBJECTS)
+    def test_same_digest_without_numpy(self, obj):
+        assert hashing.Hasher(stream=True).hash(obj) == hashing.Hasher().hash(obj)
+
+    def test_stream_memory(self):
+        obj = dict(('key_%d' % i, list(range(100))) for i in range(5000))
+        buffered_peak = peak_memory(hashing.Hasher().hash, obj)
+        streamed_peak = peak_memory(hashing.Hasher(stream=True).hash, obj)
+        assert streamed_peak < buffered_peak / 2
+
+
+class TestTreeHash():
+
+    def test_tree_digest(self, monkeypatch):
+        monkeypatch.setattr(hashing, 'TREE_BLOCK_SIZE', 16)
+        buffer = bytes(range(40))
+        root = hashlib.md5()
+        for start in (0, 16, 32):
+            root.update(hashlib.md5(buffer[start:start + 16]).digest())
+        assert hashing.tree_digest(buffer) == root.digest()
+
+    def test_parallel_hash(self, monkeypatch):
+        monkeypatch.setattr(hashing, 'TREE_BLOCK_SIZE', 2 ** 10)
+        arr = np.random.RandomState(0).rand(100, 100)
+        digest = hashing.hash(arr, parallel=True)
+        assert digest != hashing.hash(arr)
+        assert digest == hashing.hash(arr.copy(), parallel=True)
+        assert digest != hashing.hash(arr + 1, parallel=True)
+
+    def test_parse_scheme(self):
+        assert hashing.parse_scheme('md5') == {
+            'hash_name': 'md5', 'parallel': False, 'pandas': False, 'content': False}
+        assert hashing.parse_scheme('blake2b+pandas+tree') == {
+            'hash_name': 'blake2b', 'parallel': True, 'pandas': True, 'content': False}
+        assert hashing.parse_scheme('sha256+content')['content'] == True
+        with pytest.raises(ValueError):
+            hashing.parse_scheme('md5+unknown')
+        with pytest.raises(ValueError):
+            hashing.parse_scheme('md5+content+tree')
+
+    def test_hashing_writer(self):
+        f = io.BytesIO()
+        writer = hashing.HashingWriter(f, 'sha256')
+        writer.write(b'some ')
+        writer.write(b'content')
+        assert f.getvalue() == b'some content'
+        assert writer.hexdigest() == hashlib.sha256(b'some content').hexdigest()
+
+
+class TestPandasHash():
+
+    @pytest.fixture
+    def pd(self):
+        return pytest.importorskip('pandas')
+
+    @pytest.fixture
+    def frame(self, pd):
+        rng = np.random.RandomState(0)
+        return pd.DataFrame({
+            'floats': rng.rand(100),
+            'ints': rng.randint(0, 10, 100),
+            'strings': ['value_%d' % i for i in range(100)],
+            'dates': pd.date_range('2016-01-01', periods=100),
+        })
+
+    def test_same_digest_for_equal_frames(self, frame):
+        digest = hashing.hash(frame, pandas=True)
+        assert digest != hashing.hash(frame)
+        assert digest == hashing.hash(frame.copy(), pandas=True)
+
+    def test_digest_changes_with_content(self, frame):
+        digest = hashing.hash(frame, pandas=True)
+        changed = frame.copy()
+        changed.loc[3, 'floats'] = 0.5
+        assert hashing.hash(changed, pandas=True) != digest
+        changed = frame.copy()
+        changed.loc[3, 'strings'] = 'other'
+        assert hashing.hash(changed, pandas=True) != digest
+        assert hashing.hash(frame.set_index('ints'), pandas=True) != digest
+        assert hashing.hash(frame.rename(columns={'ints': 'integers'}), pandas=True) != digest
+        assert hashing.hash(frame.astype({'ints': 'float64'}), pandas=True) != digest
+
+    def test_mixed_object_columns(self, pd):
+        strings = pd.Series(['1', 'a'])
+        mixed = pd.Series([1, 'a'])
+        assert hashing.hash(strings, pandas=True) != hashing.hash(mixed, pandas=True)
+
+    def test_str_and_bytes_columns(self, pd):
+        strings = pd.Series(['a', 'b'], dtype=object)
+        bytestrings = pd.Series([b'a', b'b'])
+        assert hashing.hash(strings, pandas=True) != hashing.hash(bytestrings, pandas=True)
+        assert hashing.hash(pd.DataFrame({'c': strings}), pandas=True) != \
+            hashing.hash(pd.DataFrame({'c': bytestrings}), pandas=True)
+
+    def test_series_and_index(self, pd, frame):
+        series = frame['floats']
+        assert hashing.hash(series, pandas=True) == hashing.hash(series.copy(), pandas=True)
+        index = pd.MultiIndex.from_product([['a', 'b'], [1, 2]])
+        assert hashing.hash(index, pandas=True) == hashing.hash(index.copy(), pandas=True)
+
+    def test_same_digest_whatever_the_layout(self, pd, monkeypatch):
+        monkeypatch.setattr(hashing, '_CHUNK_SIZE', 64)
+        arr = np.random.RandomState(0).rand(100, 4)
+        from_columns = pd.DataFrame(dict((i, arr[:, i].copy()) for i in range(4)))
+        from_array = pd.DataFrame(arr, columns=from_columns.columns)
+        assert hashing.hash(from_array, pandas=True) == hashing.hash(from_columns, pandas=True)
+        assert hashing.hash(from_array[0], pandas=True) == hashing.hash(from_columns[0], pandas=True)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from django.apps import apps
+from django.db import connection
+
+import estimators
+from estimators import preload
+from estimators.cache import object_cache
+from estimators.models.datasets import DataSet
+from estimators.models.estimators import Estimator
+
+
+@pytest.mark.django_db
+class TestPreload():
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        object_cache.clear()
+        yield
+        object_cache.clear()
+
+    def test_preload_pins_objects(self, monkeypatch):
+        Estimator(estimator='preloaded_estimator').save()
+        DataSet(data=['preloaded', 'dataset']).save()
+        hashes = [Estimator._compute_hash('preloaded_estimator'), DataSet._compute_hash(['preloaded', 'dataset'])]
+
+        instances = preload.preload(hashes)
+        assert len(instances) == 2
+        assert object_cache.stats()['pinned'] == 2
+
+        def fail(self):
+            raise AssertionError('preloaded objects are not read again')
+        monkeypatch.setattr(Estimator, '_open_object_file', fail)
+        # served although the cache is disabled
+        assert not object_cache.enabled
+        e = Estimator.objects.get(object_hash=hashes[0])
+        assert e.estimator is instances[0].estimator
+        assert DataSet.objects.get(object_hash=hashes[1]).data == ['preloaded', 'dataset']
+
+    def test_preload_missing_hash(self):
+        with pytest.raises(ValueError):
+            preload.preload(['unknown_hash'])
+
+    def test_preload_on_ready(self, monkeypatch):
+        Estimator(estimator='ready_estimator').save()
+        object_hash = Estimator._compute_hash('ready_estimator')
+        monkeypatch.setattr(preload, 'PRELOAD', [object_hash])
+        monkeypatch.setattr(estimators, 'PRELOAD', [object_hash])
+
+        apps.get_app_config('estimators').ready()
+        assert object_hash not in object_cache
+
+        monkeypatch.setattr(estimators, 'PRELOAD_ON_READY', True)
+        apps.get_app_config('estimators').ready()
+        assert object_hash in object_cache
+
+    def test_preload_on_ready_does_not_raise(self, monkeypatch, caplog):
+        monkeypatch.setattr(preload, 'PRELOAD', ['unknown_hash'])
+        monkeypatch.setattr(estimators, 'PRELOAD', ['unknown_hash'])
+        monkeypatch.setattr(estimators, 'PRELOAD_ON_READY', True)
+        apps.get_app_config('estimators').ready()
+        assert 'unknown_hash' in caplog.text
+
+        # before the first migrate, nothing is queried
+        monkeypatch.setattr(connection.introspection, 'table_names', lambda: [])
+        monkeypatch.setattr(preload, 'preload', lambda: pytest.fail('the tables do not exist'))
+        apps.get_app_config('estimators').ready()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps'), reason='needs the /proc of Linux')
+class TestMemoryUsage():
+
+    def test_memory_usage(self):
+        usage = preload.memory_usage()
+        assert usage['rss'] > 0
+        assert usage['shared'] + usage['private'] == usage['rss']
@@ -0,0 +1,86 @@
+import io
+
+import dill
+import numpy as np
+import pytest
+
+from estimators import serializers
+from estimators.models.datasets import DataSet
+from estimators.models.estimators import Estimator
+
+
+class TestSerializers():
+
+    @pytest.mark.parametrize('name', ['dill', 'pickle', 'numpy'])
+    def test_roundtrip(self, name):
+        obj = {'weights': np.arange(10.0), 'labels': ['a', 'b'], 'depth': 3}
+        serializer = serializers.get_serializer(name)
+        f = io.BytesIO()
+        serializer.dump(obj, f)
+        f.seek(0)
+        loaded = serializer.load(f)
+        assert np.array_equal(loaded['weights'], obj['weights'])
+        assert loaded['labels'] == obj['labels']
+        assert loaded['depth'] == 3
+
+    def test_numpy_format_keeps_shared_arrays(self):
+        arr = np.arange(10)
+        f = io.BytesIO()
+        serializers.get_serializer('numpy').dump([arr, arr], f)
+        f.seek(0)
+        first, second = serializers.get_serializer('numpy').load(f)
+        assert first is second
+
+    def test_npy_roundtrip(self):
+        arr = np.arange(12).reshape(3, 4)
+        f = io.BytesIO()
+        serializers.get_serializer('npy').dump(arr, f)
+        f.seek(0)
+        assert np.array_equal(serializers.get_serializer('npy').load(f), arr)
+
+    def test_choose_serializer(self):
+        assert serializers.choose_serializer(np.arange(3)).name == 'npy'
+        assert serializers.choose_serializer(np.array([None])).name == 'dill'
+        assert serializers.choose_serializer('a string').name == 'dill'
+
+    def test_detect_serializer(self):
+        for name in ['numpy', 'npy']:
+            f = io.BytesIO()
+            serializers.get_serializer(name).dump(np.arange(3), f)
+            f.seek(0)
+            assert serializers.detect_serializer(f).name == name
+            assert f.tell() == 0
+        assert serializers.detect_serializer(io.BytesIO(dill.dumps('legacy'))).name == 'dill'
+
+    def test_unknown_serializer(self):
+        with pytest.raises(ValueError):
+            serializers.get_serializer('unknown')
+
+
+@pytest.mark.django_db
+class TestObjectFormat():
+
+    def test_format_recorded(self):
+        e = Estimator(estimator='serialized with dill')
+        e.save()
+        assert e.object_format == 'dill'
+
+        ds = DataSet(data=np.arange(5))
+        ds.save()
+        assert ds.object_format == 'npy'
+
+    def test_format_dispatch(self, monkeypatch):
+        monkeypatch.setattr(serializers, 'SERIALIZERS', {'builtins.dict': 'numpy'})
+        obj = {'coefficients': np.arange(4.0)}
+        Estimator(estimator=obj).save()
+
+        e = Estimator.objects.get(object_hash=Estimator._compute_hash(obj))
+        assert e.object_format == 'numpy'
+        assert np.array_equal(e.estimator['coefficients'], obj['coefficients'])
+
+    def test_load_without_format(self):
+        Estimator(estimator='persisted before formats').save()
+        Estimator.objects.update(object_format='')
+
+        e = Estimator.objects.get()
+        assert e.estimator == 'persisted before formats'
@@ -0,0 +1,295 @@
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.core.management import call_command
+
+from estimators.models import base
+from estimators.models.datasets import DataSet
+from estimators.storage import CachedStorage, PackStorage, save_object_file
+
+
+@pytest.fixture
+def pack_storage(tmpdir):
+    inner = FileSystemStorage(location=str(tmpdir.join('files')))
+    return PackStorage(location=str(tmpdir.join('packs')), threshold=100, inner=inner)
+
+
+class TestPackStorage():
+
+    def test_small_objects_packed(self, pack_storage):
+        pack_storage.save('datasets/a', ContentFile(b'first object'))
+        pack_storage.save('datasets/b', ContentFile(b'second'))
+
+        assert pack_storage.exists('datasets/a')
+        assert pack_storage.size('datasets/b') == 6
+        assert pack_storage.open('datasets/b').read() == b'second'
+        assert not pack_storage.inner.exists('datasets/a')
+        assert sorted(os.listdir(pack_storage.pack_location)) == [
+            'pack-00000000.idx', 'pack-00000000.pack', 'packs.lock']
+        with pytest.raises(NotImplementedError):
+            pack_storage.path('datasets/a')
+
+    def test_large_objects_in_inner_storage(self, pack_storage):
+        pack_storage.save('datasets/large', ContentFile(b'x' * 101))
+        assert pack_storage.inner.exists('datasets/large')
+        assert pack_storage.path('datasets/large') == pack_storage.inner.path('datasets/large')
+        assert pack_storage.open('datasets/large').read() == b'x' * 101
+
+    def test_writes_of_other_processes(self, pack_storage):
+        other = PackStorage(location=pack_storage.pack_location, threshold=100, inner=pack_storage.inner)
+        assert not pack_storage.exists('datasets/a')
+        other.save('datasets/a', ContentFile(b'written elsewhere'))
+        assert pack_storage.open('datasets/a').read() == b'written elsewhere'
+        other.delete('datasets/a')
+        pack_storage._refresh_index()
+        assert not pack_storage.exists('datasets/a')
+
+    def test_save_after_compaction_by_other_process(self, pack_storage):
+        other = PackStorage(location=pack_storage.pack_location, threshold=100, inner=pack_storage.inner)
+        pack_storage.save('datasets/a', ContentFile(b'compacted away'))
+        assert other.exists('datasets/a')
+
+        other.compact([], min_age=0)
+        assert not pack_storage.exists('datasets/a')
+        save_object_file(pack_storage, 'datasets/a', ContentFile(b'compacted away'))
+        assert pack_storage.open('datasets/a').read() == b'compacted away'
+        assert other.open('datasets/a').read() == b'compacted away'
+
+    def test_pack_rotation(self, pack_storage):
+        pack_storage.max_pack_bytes = 50
+        for i in range(10):
+            pack_storage.save('datasets/%d' % i, ContentFile(('%020d' % i).encode()))
+        assert len(pack_storage._pack_numbers()) == 5
+        expected = [('%020d' % i).encode() for i in range(10)]
+        assert [pack_storage.open('datasets/%d' % i).read() for i in range(10)] == expected
+
+    def test_concurrent_saves(self, pack_storage):
+        threads = [threading.Thread(target=pack_storage.save,
+                                    args=('datasets/%d' % i, ContentFile(('%d' % i).encode())))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other = PackStorage(location=pack_storage.pack_location, inner=pack_storage.inner)
+        assert [other.open('datasets/%d' % i).read() for i in range(20)] == [('%d' % i).encode() for i in range(20)]
+
+    def test_compact(self, pack_storage):
+        for i in range(10):
+            pack_storage.save('datasets/%d' % i, ContentFile(('object %d' % i).encode()))
+        pack_storage.delete('datasets/0')
+        other = PackStorage(location=pack_storage.pack_location, inner=pack_storage.inner)
+        other.exists('datasets/1')
+
+        assert pack_storage.compact(['datasets/1', 'datasets/2', 'datasets/0'], min_age=0) == 7
+
+        assert not pack_storage.exists('datasets/0')
+        assert not pack_storage.exists('datasets/3')
+        # a reader with a stale index finds the objects in the new packs
+        assert other.open('datasets/2').read() == b'object 2'
+        assert other.size('datasets/1') == 8
+        assert pack_storage.compact([], min_age=3600) == 0
+
+
+@pytest.mark.django_db
+class TestPackedDataSets():
+
+    def test_persist_and_load(self, pack_storage, monkeypatch):
+        monkeypatch.setattr(DataSet._meta.get_field('object_file'), 'storage', pack_storage)
+        DataSet(data=['packed', 'list']).save()
+        ds = DataSet.objects.get()
+        assert not pack_storage.inner.exists(ds.upload_path)
+        assert ds.data == ['packed', 'list']
+
+        DataSet(data=['unreferenced']).save()
+        DataSet.objects.filter(pk__gt=ds.pk).delete()
+        call_command('compact_packs', min_age=0, stdout=io.StringIO())
+        assert DataSet.objects.get().data == ['packed', 'list']
+        assert len(pack_storage._index) == 1
+
+
+class RemoteStorage(Storage):
+
+    """a local directory standing for an object storage: it has no paths, and counts opens"""
+
+    def __init__(self, location):
+        self.local = FileSystemStorage(location=location)
+        self.opened = 0
+
+    def _open(self, name, mode='rb'):
+        self.opened += 1
+        return self.local.open(name, mode)
+
+    def _save(self, name, content):
+        return self.local.save(name, content)
+
+    def delete(self, name):
+        self.local.delete(name)
+
+    def exists(self, name):
+        return self.local.exists(name)
+
+    def size(self, name):
+        return self.local.size(name)
+
+
+@pytest.fixture
+def cached_storage(tmpdir):
+    remote = RemoteStorage(location=str(tmpdir.join('remote')))
+    return CachedStorage(location=str(tmpdir.join('cache')), max_bytes=1000, inner=remote, min_age=0)
+
+
+class TestCachedStorage():
+
+    def test_read_through(self, cached_storage):
+        cached_storage.save('datasets/a', ContentFile(b'remote content'))
+        assert not os.path.exists(cached_storage._cache_path('datasets/a'))
+
+        assert cached_storage.open('datasets/a').read() == b'remote content'
+        assert cached_storage.open('datasets/a').read() == b'remote content'
+        path = cached_storage.path('datasets/a')
+        assert open(path, 'rb').read() == b'remote content'
+        assert cached_storage.inner.opened == 1
+
+    def test_lru_eviction(self, cached_storage):
+        for name in 'abcd':
+            cached_storage.save('datasets/' + name, ContentFile(name.encode() * 300))
+        for i, name in enumerate('abc'):
+            path = cached_storage.path('datasets/' + name)
+            os.utime(path, (i, i))
+        cached_storage.path('datasets/a')
+        cached_storage.path('datasets/d')
+
+        cached = sorted(os.path.basename(path) for _, _, path in cached_storage._cached_files())
+        assert cached == ['a', 'c', 'd']
+        assert sum(size for _, size, _ in cached_storage._cached_files()) <= 1000
+
+    def test_cache_walked_only_when_full(self, cached_storage, monkeypatch):
+        walks = []
+        cached_files = cached_storage._cached_files
+        monkeypatch.setattr(cached_storage, '_cached_files', lambda: walks.append(1) or cached_files())
+        for name in 'abcdef':
+            cached_storage.save('datasets/' + name, ContentFile(name.encode() * 150))
+        for name in 'abcdef':
+            cached_storage.path('datasets/' + name)
+        # the first fill measures the cache, the next ones keep its total up to date
+        assert len(walks) == 1
+        assert cached_storage._add_bytes(0) == 900
+
+        cached_storage.delete('datasets/a')
+        assert cached_storage._add_bytes(0) == 750
+        # shared with the other processes of the host
+        other = CachedStorage(location=cached_storage.cache_location, max_bytes=1000,
+                              inner=cached_storage.inner, min_age=0)
+        for name in 'gh':
+            cached_storage.save('datasets/' + name, ContentFile(name.encode() * 150))
+            other.path('datasets/' + name)
+        assert len(walks) == 1
+        assert sum(size for _, size, _ in cached_files()) <= 1000
+
+    def test_concurrent_fills(self, cached_storage):
+        cached_storage.save('datasets/a', ContentFile(b'x' * 500))
+        threads = [threading.Thread(target=cached_storage.path, args=('datasets/a',)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cached_storage.inner.opened == 1
+        assert os.listdir(os.path.dirname(cached_storage._cache_path('datasets/a'))) == ['a']
+
+    def test_delete(self, cached_storage):
+        cached_storage.save('datasets/a', ContentFile(b'deleted'))
+        cached_storage.path('datasets/a')
+        cached_storage.delete('datasets/a')
+        assert not cached_storage.exists('datasets/a')
+
+
+@pytest.mark.django_db
+class TestCachedDataSets():
+
+    def test_load_from_local_disk(self, cached_storage, monkeypatch):
+        cached_storage.max_bytes = 2 ** 20
+        monkeypatch.setattr(DataSet._meta.get_field('object_file'), 'storage', cached_storage)
+        arr = np.arange(100)
+        DataSet(data=arr).save()
+
+        for _ in range(2):
+            ds = DataSet.objects.get(object_hash=DataSet._compute_hash(arr))
+            assert isinstance(ds.data, np.memmap)
+            assert np.array_equal(ds.data, arr)
+        assert cached_storage.inner.opened == 1
+
+
+class RacingStorage(RemoteStorage):
+
+    """a remote storage to which another writer saves the first file checked, just after"""
+
+    def __init__(self, location):
+        super().__init__(location)
+        self.raced = False
+
+    def exists(self, name):
+        if not self.raced:
+            self.raced = True
+            self.local.save(name, ContentFile(b'written by another writer'))
+            return False
+        return super().exists(name)
+
+
+class TestSaveObjectFile():
+
+    def test_local_write(self, tmpdir):
+        storage = FileSystemStorage(location=str(tmpdir))
+        assert save_object_file(storage, 'datasets/ab/abcd', ContentFile(b'object')) == 'datasets/ab/abcd'
+        assert storage.open('datasets/ab/abcd').read() == b'object'
+        # the temporary file was renamed
+        assert os.listdir(str(tmpdir.join('datasets', 'ab'))) == ['abcd']
+
+    def test_stored_file_not_written_again(self, tmpdir):
+        storage = FileSystemStorage(location=str(tmpdir))
+        save_object_file(storage, 'datasets/abcd', ContentFile(b'object'))
+        assert save_object_file(storage, 'datasets/abcd', ContentFile(b'other')) == 'datasets/abcd'
+        assert storage.open('datasets/abcd').read() == b'object'
+        assert os.listdir(str(tmpdir.join('datasets'))) == ['abcd']
+
+    def test_lost_race_leaves_a_single_file(self, tmpdir):
+        storage = RacingStorage(location=str(tmpdir))
+        assert save_object_file(storage, 'datasets/abcd', ContentFile(b'object')) == 'datasets/abcd'
+        assert os.listdir(str(tmpdir.join('datasets'))) == ['abcd']
+
+
+@pytest.mark.django_db
+class TestConcurrentPersist():
+
+    def test_concurrent_writers_write_once(self, monkeypatch):
+        writes = []
+
+        def slow_save(storage, name, content):
+            writes.append(name)
+            time.sleep(0.2)
+            return save_object_file(storage, name, content)
+        monkeypatch.setattr(base, 'save_object_file', slow_save)
+        arr = np.arange(7, 17)
+        instances = [DataSet(data=arr) for _ in range(5)]
+        threads = [threading.Thread(target=instance._persist_file) for instance in instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(writes) == 1
+        assert set(instance.object_file.name for instance in instances) == {instances[0].upload_path}
+        assert all(instance.persisted_at is not None for instance in instances)
+
+        # the file is found stored, get_or_create does not write it again
+        ds, created = DataSet.objects.get_or_create(data=arr)
+        assert created
+        assert len(writes) == 1
+        stored = os.listdir(os.path.dirname(ds.file_path))
+        assert not [name for name in stored if name.startswith(ds.object_hash + '_')]